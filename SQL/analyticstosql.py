@@ -0,0 +1,161 @@
+import io
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from SQL.setup_db import db, create_app
+from core.analytics import ANALYTICS_COLUMNS, compute_analytics
+from core.benchmarks import BENCHMARK_COLUMNS, BENCHMARK_PATH, compute_benchmark_analytics, load_benchmarks
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ANALYTICS_STAGE_TABLE = "mf_fund_analytics_stage"
+# mf_fund_analytics CHECK constraints; values outside them are written as NULL rather than failing the batch
+CHECK_RANGES = {'sharpe_ratio': (-10, 10), 'r_squared': (0, 100), 'beta': (0, np.inf)}
+# staged columns that are not double precision
+COLUMN_TYPES = {'benchmark_index': 'varchar(50)'}
+
+CREATE_UNIQUE_INDEX = """CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_isin_period_date
+                         ON mf_fund_analytics (isin, calculation_period, calculation_date)"""
+
+
+def create_stage(columns):
+    return f"""CREATE TEMP TABLE IF NOT EXISTS {ANALYTICS_STAGE_TABLE} (
+                   isin varchar(12) NOT NULL,
+                   calculation_period varchar(20) NOT NULL,
+                   calculation_date date NOT NULL,
+                   {", ".join(f"{column} {COLUMN_TYPES.get(column, 'double precision')}" for column in columns)}
+               ) ON COMMIT DROP"""
+
+
+def merge_statement(columns):
+    """one set-based merge of the staged metrics; funds missing from mf_fund are dropped by the join"""
+    return f"""WITH merged AS (
+                   INSERT INTO mf_fund_analytics (isin, calculation_period, calculation_date, {", ".join(columns)},
+                                                  created_at, updated_at)
+                   SELECT s.isin, s.calculation_period, s.calculation_date, {", ".join(f"s.{column}" for column in columns)},
+                          now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+                   FROM {ANALYTICS_STAGE_TABLE} s JOIN mf_fund f ON f.isin = s.isin
+                   ON CONFLICT (isin, calculation_period, calculation_date) DO UPDATE
+                   SET {", ".join(f"{column} = EXCLUDED.{column}" for column in columns)},
+                       updated_at = EXCLUDED.updated_at
+                   RETURNING (xmax = 0) AS inserted)
+               SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged"""
+
+
+def analytics_records(analytics, columns=ANALYTICS_COLUMNS):
+    """
+    engine output -> mf_fund_analytics records: rows without a growth ISIN are dropped, a repeated
+    (isin, period) keeps its first row and values outside the table's CHECK ranges become NULL
+    """
+    records = analytics[analytics['ISIN'].astype(str).str.len() == 12]
+    records = records.drop_duplicates(['ISIN', 'calculation_period'], keep='first')
+    records = records[['ISIN', 'calculation_period', 'calculation_date', *columns]].rename(columns={'ISIN': 'isin'})
+    for column, (low, high) in CHECK_RANGES.items():
+        if column in records:
+            records[column] = records[column].where(records[column].between(low, high))
+    return records
+
+
+def import_analytics(analytics, columns=ANALYTICS_COLUMNS):
+    """
+    Bulk write engine output to mf_fund_analytics: COPY into a staging table, one merge, commit (needs an app context)
+
+    Args:
+        analytics: frame of `core.analytics.compute_analytics` (or any frame with ISIN, calculation_period,
+            calculation_date and `columns`)
+        columns: metric (and reference) columns to write; the other columns of existing rows are left as they are
+
+    Returns:
+        dict: Statistics about the import operation, with per-phase timings (seconds)
+    """
+    timings = {}
+    phase = time.perf_counter()
+    records = analytics_records(analytics, columns)
+    timings['prepare'] = time.perf_counter() - phase
+    stats = {'rows_staged': len(records), 'analytics_created': 0, 'analytics_updated': 0, 'funds_not_found': 0}
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        phase = time.perf_counter()
+        cursor.execute(CREATE_UNIQUE_INDEX)
+        cursor.execute(create_stage(columns))
+        buffer = io.StringIO()
+        records.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {ANALYTICS_STAGE_TABLE} (isin, calculation_period, calculation_date, {', '.join(columns)}) "
+                           f"FROM STDIN WITH (FORMAT csv)", buffer)
+        timings['copy'] = time.perf_counter() - phase
+
+        phase = time.perf_counter()
+        cursor.execute(merge_statement(columns))
+        stats['analytics_created'], stats['analytics_updated'] = cursor.fetchone()
+        stats['funds_not_found'] = len(records) - stats['analytics_created'] - stats['analytics_updated']
+        timings['merge'] = time.perf_counter() - phase
+
+        phase = time.perf_counter()
+        connection.commit()
+        timings['commit'] = time.perf_counter() - phase
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error importing analytics: {e}")
+        raise
+    finally:
+        connection.close()
+
+    stats['timings'] = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+    logger.info(f"Analytics import completed: {stats}")
+    return stats
+
+
+def update_analytics(nav_matrix_path=NAV_MATRIX_PATH, as_of=None):
+    """risk metrics of every scheme and period as of `as_of` (default: today - DELTA_DAYS) into mf_fund_analytics"""
+    if as_of is None:
+        DELTA_DAYS = int(os.environ.get("DELTA_DAYS", 0))
+        as_of = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    started = time.perf_counter()
+    analytics = compute_analytics(NavMatrix.load(nav_matrix_path), as_of)
+    logger.info(f"{len(analytics)} scheme-periods computed as of {as_of} in {time.perf_counter() - started:.2f}s")
+    return import_analytics(analytics)
+
+
+def fund_benchmarks():
+    """{isin: benchmark} of every factsheet naming a benchmark"""
+    rows = db.session.execute(text("SELECT isin, benchmark FROM mf_factsheet WHERE benchmark IS NOT NULL")).fetchall()
+    return pd.Series({isin: benchmark for isin, benchmark in rows}, dtype=object)
+
+
+def update_benchmark_analytics(nav_matrix_path=NAV_MATRIX_PATH, benchmark_path=BENCHMARK_PATH, as_of=None):
+    """
+    benchmark-relative metrics of every fund whose factsheet names a benchmark found in the index file,
+    for every period as of `as_of` (default: today - DELTA_DAYS), into mf_fund_analytics with its benchmark_index
+    """
+    if not os.path.exists(benchmark_path):
+        logger.warning(f"no index file at {benchmark_path}, benchmark-relative metrics skipped")
+        return None
+    if as_of is None:
+        DELTA_DAYS = int(os.environ.get("DELTA_DAYS", 0))
+        as_of = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    started = time.perf_counter()
+    analytics = compute_benchmark_analytics(NavMatrix.load(nav_matrix_path), load_benchmarks(benchmark_path),
+                                            fund_benchmarks(), as_of)
+    logger.info(f"{len(analytics)} fund-periods computed against {analytics['benchmark_index'].nunique()} benchmarks "
+                f"as of {as_of} in {time.perf_counter() - started:.2f}s")
+    return import_analytics(analytics, columns=BENCHMARK_COLUMNS + ['benchmark_index'])
+
+
+if __name__ == "__main__":
+
+    app = create_app()  # Create the Flask app instance
+    with app.app_context():  # Push application context
+        update_analytics()
+        update_benchmark_analytics()
@@ -136,6 +136,38 @@ class FundReturns(db.Model):
     )
 
 
+class FundReturnsHistory(db.Model):
+    """
+    Daily returns snapshots of a mutual fund, one row per (isin, as_of_date).
+    Range partitioned by as_of_date (one partition per year, created by the returns upsert)
+    """
+    __tablename__ = 'mf_returns_history'
+
+    isin = db.Column(db.String(12),
+                     db.ForeignKey('mf_fund.isin'),
+                     primary_key=True)
+    as_of_date = db.Column(db.Date, primary_key=True)  # Partition key
+    return_1m = db.Column(db.Float, nullable=True)
+    return_3m = db.Column(db.Float, nullable=True)
+    return_6m = db.Column(db.Float, nullable=True)
+    return_ytd = db.Column(db.Float, nullable=True)
+    return_1y = db.Column(db.Float, nullable=True)
+    return_3y = db.Column(db.Float, nullable=True)
+    return_5y = db.Column(db.Float, nullable=True)
+    return_ytd_cagr = db.Column(db.Float, nullable=True)
+    return_1y_cagr = db.Column(db.Float, nullable=True)
+    return_3y_cagr = db.Column(db.Float, nullable=True)
+    return_5y_cagr = db.Column(db.Float, nullable=True)
+    return_10y_cagr = db.Column(db.Float, nullable=True)
+    return_since_inception = db.Column(db.Float, nullable=True)
+    return_since_inception_cagr = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        Index('idx_returns_history_as_of_date', 'as_of_date', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (as_of_date)'},
+    )
+
+
 class FundHolding(db.Model):
     """
     Holdings/investments within a mutual fund
@@ -202,6 +234,21 @@ class NavHistory(db.Model):
     )
 
 
+class NavHistorySync(db.Model):
+    """
+    Sync state of mf_nav_history: the latest NAV date pushed per fund
+    """
+    __tablename__ = 'mf_nav_history_sync'
+
+    isin = db.Column(db.String(12),
+                     db.ForeignKey('mf_fund.isin'),
+                     primary_key=True)
+    synced_through = db.Column(db.Date, nullable=False)  # High-water mark
+    synced_at = db.Column(db.DateTime,
+                          default=datetime.utcnow,
+                          onupdate=datetime.utcnow)
+
+
 class FundRating(db.Model):
     """
     Fund ratings from various rating agencies
@@ -326,6 +373,8 @@ class FundAnalytics(db.Model):
         Index('idx_analytics_calculation_date', 'calculation_date'),
         Index('idx_analytics_period', 'calculation_period'),
         Index('idx_analytics_benchmark', 'benchmark_index'),
+        Index('idx_analytics_isin_period_date', 'isin', 'calculation_period',
+              'calculation_date', unique=True),  # One row per fund, period and day
         CheckConstraint('r_squared >= 0 AND r_squared <= 100',
                         name='check_r_squared_range'),
         CheckConstraint('sharpe_ratio >= -10 AND sharpe_ratio <= 10',
@@ -0,0 +1,252 @@
+import io
+import os
+import sys
+import time
+import logging
+import pandas as pd
+from sqlalchemy import text
+
+from SQL.setup_db import db, create_app
+from SQL.models import NavHistorySync
+from core.nav_store import NAV_STORE_PATH, INGESTED_COLUMN, scan_nav_store
+from core.scheme_registry import SchemeRegistry, SCHEME_REGISTRY_PATH, ISIN_COLUMNS
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# rows per COPY + merge round trip (one transaction each)
+NAV_COPY_BATCH_ROWS = int(os.environ.get("NAV_COPY_BATCH_ROWS", 200_000))
+# days before each fund's watermark that an incremental sync sends again, so AMFI's revisions of recent NAVs land
+NAV_SYNC_LOOKBACK_DAYS = int(os.environ.get("NAV_SYNC_LOOKBACK_DAYS", 7))
+STAGE_TABLE = "mf_nav_history_stage"
+STORE_COLUMNS = ['Scheme Code', ISIN_COLUMNS[0], 'Net Asset Value', 'Date', INGESTED_COLUMN]
+
+CREATE_STAGE = f"""CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} (
+                       isin varchar(12) NOT NULL,
+                       date date NOT NULL,
+                       nav double precision NOT NULL
+                   ) ON COMMIT DELETE ROWS"""
+# rows of funds missing from mf_fund are dropped by the join (the foreign key would reject them).
+# xmax is 0 only for freshly inserted rows, which splits the merge into inserts and updates
+MERGE = f"""WITH merged AS (
+                INSERT INTO mf_nav_history (isin, date, nav)
+                SELECT s.isin, s.date, s.nav
+                FROM {STAGE_TABLE} s JOIN mf_fund f ON f.isin = s.isin
+                ON CONFLICT (isin, date) DO {{on_conflict}}
+                RETURNING (xmax = 0) AS inserted)
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged"""
+ON_CONFLICT_UPDATE = "UPDATE SET nav = EXCLUDED.nav WHERE mf_nav_history.nav IS DISTINCT FROM EXCLUDED.nav"
+ON_CONFLICT_NOTHING = "NOTHING"
+MARK_SYNCED = f"""INSERT INTO mf_nav_history_sync (isin, synced_through, synced_at)
+                  SELECT s.isin, max(s.date), now()
+                  FROM {STAGE_TABLE} s JOIN mf_fund f ON f.isin = s.isin
+                  GROUP BY s.isin
+                  ON CONFLICT (isin) DO UPDATE
+                  SET synced_through = GREATEST(mf_nav_history_sync.synced_through, EXCLUDED.synced_through),
+                      synced_at = EXCLUDED.synced_at"""
+# funds whose full history was looked for but had no rows in the store: watermarked at the latest date synced
+# (today on an empty table), so the next syncs pick up their NAVs as they arrive instead of scanning the store again
+MARK_CHECKED = text("""INSERT INTO mf_nav_history_sync (isin, synced_through, synced_at)
+                       SELECT isin, COALESCE((SELECT max(synced_through) FROM mf_nav_history_sync), CURRENT_DATE), now()
+                       FROM unnest(CAST(:isins AS varchar[])) AS isin
+                       ON CONFLICT (isin) DO NOTHING""")
+
+
+def nav_history_rows(df, registry=None):
+    """
+    NAV store rows -> mf_nav_history rows (isin, date, nav)
+
+    The growth ISIN of each row is used, falling back to the scheme registry's for rows stored without one.
+    Rows without an ISIN or without a positive NAV are dropped (the daily file's missing NAVs are stored as 0),
+    as are repeated (isin, date) pairs: the most recently ingested one wins, like the store's own compaction.
+    """
+    isin = df[ISIN_COLUMNS[0]].astype(object)
+    if registry is not None and isin.isna().any():
+        known = registry.meta(df['Scheme Code'], fields=(ISIN_COLUMNS[0],))[ISIN_COLUMNS[0]].to_numpy()
+        isin = isin.where(isin.notna(), pd.Series(known, index=isin.index))
+    nav = df['Net Asset Value']
+    keep = (isin.str.len() == 12) & (nav > 0)
+    rows = pd.DataFrame({'isin': isin[keep], 'date': df['Date'][keep], 'nav': nav[keep]})
+    if INGESTED_COLUMN in df.columns:
+        ingested = df[INGESTED_COLUMN][keep].reset_index(drop=True)
+        rows = rows.iloc[ingested.sort_values(kind="stable", na_position="first").index]
+    return rows.drop_duplicates(['isin', 'date'], keep="last")
+
+
+def copy_rows(cursor, rows):
+    """COPY `rows` into the staging table (CSV through an in-memory buffer)"""
+    buffer = io.StringIO()
+    rows.to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {STAGE_TABLE} (isin, date, nav) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def merge_batches(batches, update=True):
+    """
+    COPY + merge each (rows read, mf_nav_history rows) batch in its own transaction (needs an app context)
+
+    The sync watermark of every fund in a batch is moved on in the same transaction, so an interrupted run
+    keeps its finished batches and the state never runs ahead of the table.
+
+    Returns:
+        dict: Statistics about the merge
+    """
+    merge = MERGE.format(on_conflict=ON_CONFLICT_UPDATE if update else ON_CONFLICT_NOTHING)
+    stats = {'rows_read': 0, 'rows_staged': 0, 'rows_inserted': 0, 'rows_updated': 0, 'batches': 0}
+    started = time.perf_counter()
+
+    NavHistorySync.__table__.create(db.engine, checkfirst=True)
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(CREATE_STAGE)
+        connection.commit()
+        for rows_read, rows in batches:
+            stats['rows_read'] += rows_read
+            if len(rows) == 0:
+                continue
+            copy_rows(cursor, rows)
+            cursor.execute(merge)
+            inserted, updated = cursor.fetchone()
+            cursor.execute(MARK_SYNCED)
+            connection.commit()
+
+            stats['rows_staged'] += len(rows)
+            stats['rows_inserted'] += inserted
+            stats['rows_updated'] += updated
+            stats['batches'] += 1
+            elapsed = time.perf_counter() - started
+            logger.info(f"batch {stats['batches']}: {stats['rows_read']} rows read, {stats['rows_inserted']} inserted, "
+                        f"{stats['rows_updated']} updated ({stats['rows_read'] / elapsed:,.0f} rows/s)")
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error loading NAV history: {e}")
+        raise
+    finally:
+        connection.close()
+
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    stats['rows_per_second'] = round(stats['rows_read'] / stats['seconds']) if stats['seconds'] else 0
+    return stats
+
+
+def load_nav_history(store_path=NAV_STORE_PATH, batch_rows=NAV_COPY_BATCH_ROWS, update=True, start=None,
+                     registry_path=SCHEME_REGISTRY_PATH):
+    """
+    Bulk load the NAV store into mf_nav_history (needs an app context)
+
+    The store is streamed in batches of `batch_rows`; each batch is COPYed into a temporary staging table and
+    merged with one INSERT ... ON CONFLICT (isin, date), then committed, so an interrupted load keeps its
+    finished batches and a re-run only rewrites what changed.
+
+    Args:
+        store_path: NAV store to read
+        batch_rows (int): rows per COPY / merge transaction
+        update (bool): overwrite NAVs that changed (True) or keep the stored ones (False)
+        start: only load NAVs dated on or after `start` (None: the whole store)
+        registry_path: scheme registry used for rows stored without an ISIN (None: skip them)
+
+    Returns:
+        dict: Statistics about the load
+    """
+    registry = SchemeRegistry.load(registry_path) if registry_path else None
+    batches = ((len(df), nav_history_rows(df, registry))
+               for df in scan_nav_store(store_path, columns=STORE_COLUMNS, batch_rows=batch_rows, start=start))
+    stats = merge_batches(batches, update)
+    logger.info(f"NAV history load completed: {stats}")
+    return stats
+
+
+def sync_watermarks():
+    """
+    Per-fund high-water marks {isin: latest NAV date pushed}, from mf_nav_history_sync
+
+    A table loaded before the sync state existed is seeded once from max(date) per ISIN.
+    """
+    NavHistorySync.__table__.create(db.engine, checkfirst=True)
+    marks = db.session.execute(text("SELECT isin, synced_through FROM mf_nav_history_sync")).fetchall()
+    if not marks:
+        db.session.execute(text("""INSERT INTO mf_nav_history_sync (isin, synced_through, synced_at)
+                                   SELECT isin, max(date), now() FROM mf_nav_history GROUP BY isin"""))
+        db.session.commit()
+        marks = db.session.execute(text("SELECT isin, synced_through FROM mf_nav_history_sync")).fetchall()
+    return {isin: pd.Timestamp(date) for isin, date in marks}
+
+
+def sync_nav_history(store_path=NAV_STORE_PATH, lookback_days=NAV_SYNC_LOOKBACK_DAYS, batch_rows=NAV_COPY_BATCH_ROWS,
+                     registry_path=SCHEME_REGISTRY_PATH):
+    """
+    Push only what mf_nav_history is missing since the last sync (needs an app context)
+
+    Only the store's rows since the latest watermark (less `lookback_days`) are read for every fund. Funds whose
+    watermark trails it by more than that (stale or suspended schemes) catch up in a second read of the rows
+    before that start, from their oldest watermark and only for their scheme codes. Each fund sends the rows
+    dated after its own watermark plus the `lookback_days` before it: the latter are compared in the merge,
+    and NAVs AMFI revised since they were sent become updates. Funds of mf_fund without a watermark
+    (new funds, or a first sync) get their whole history, read only for their scheme codes; those without any
+    rows in the store are watermarked at the latest date synced, so they are not looked for again.
+    Older history added to the store later (a backfill) is not picked up; load it with `load_nav_history(start=...)`.
+
+    Returns:
+        dict: Statistics about the sync (`rows_updated` counts the revisions found)
+    """
+    registry = SchemeRegistry.load(registry_path) if registry_path else None
+    marks = sync_watermarks()
+    funds = {row[0] for row in db.session.execute(text("SELECT isin FROM mf_fund"))}
+    new_funds = funds.difference(marks)
+    lookback = pd.Timedelta(days=lookback_days)
+
+    def since_marks(start, end=None, isins=None):
+        codes = None
+        if isins is not None and registry is not None and len(registry):
+            codes = registry.codes(isins=isins)
+            if len(codes) == 0:
+                return
+        for df in scan_nav_store(store_path, columns=STORE_COLUMNS, batch_rows=batch_rows, start=start, end=end,
+                                 scheme_codes=codes):
+            rows = nav_history_rows(df, registry)
+            since = rows['isin'].map(marks) - lookback
+            yield len(df), rows[(rows['date'] > since).to_numpy()]
+
+    def full_history():
+        codes = None
+        if registry is not None and len(registry):
+            codes = registry.codes(isins=new_funds)
+            if len(codes) == 0:
+                return
+        for df in scan_nav_store(store_path, columns=STORE_COLUMNS, batch_rows=batch_rows, scheme_codes=codes):
+            rows = nav_history_rows(df, registry)
+            yield len(df), rows[rows['isin'].isin(new_funds).to_numpy()]
+
+    stats = {}
+    if marks:
+        start = max(marks.values()) - lookback
+        logger.info(f"syncing {len(marks)} funds since {max(marks.values()).date()} ({lookback_days} days lookback)")
+        stats['since_watermark'] = merge_batches(since_marks(start))
+        lagging = {isin: mark for isin, mark in marks.items() if mark - lookback < start}
+        if lagging:
+            oldest = min(lagging.values()) - lookback
+            logger.info(f"catching up {len(lagging)} funds whose watermark trails, since {oldest.date()}")
+            stats['lagging'] = merge_batches(since_marks(oldest, start - pd.Timedelta(days=1), lagging))
+    if new_funds:
+        logger.info(f"syncing the full history of {len(new_funds)} funds without a watermark")
+        stats['new_funds'] = merge_batches(full_history())
+        db.session.execute(MARK_CHECKED, {'isins': sorted(new_funds)})
+        db.session.commit()
+    logger.info(f"NAV history sync completed: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m SQL.navhistorytosql [--sync] [--keep-existing] [--since YYYY-MM-DD]
+    start = sys.argv[sys.argv.index("--since") + 1] if "--since" in sys.argv else None
+
+    app = create_app()  # Create the Flask app instance
+    with app.app_context():  # Push application context
+        if "--sync" in sys.argv:
+            sync_nav_history()
+        else:
+            load_nav_history(update="--keep-existing" not in sys.argv, start=start)
@@ -1,3 +1,6 @@
+import io
+import time
+import numpy as np
 import pandas as pd
 import os
 import logging
@@ -5,7 +8,7 @@ import sys
 from sqlalchemy import text
 
 from SQL.setup_db import db, create_app
-from SQL.models import FundReturns
+from SQL.models import FundReturnsHistory
 
 # Configure logging
 logging.basicConfig(
@@ -24,151 +27,168 @@ def get_existing_isins():
         return set()
 
 
-def import_returns_data(df, existing_isins=None ,clear_existing=False):
+RETURNS_STAGE_TABLE = "mf_returns_stage"
+# mf_returns columns, filled from the returns file's columns of the same name
+DB_RETURN_COLUMNS = ['return_1m', 'return_3m', 'return_6m', 'return_ytd', 'return_1y', 'return_3y', 'return_5y',
+                     'return_3y_cagr', 'return_5y_cagr', 'return_10y_cagr',
+                     'return_since_inception', 'return_since_inception_cagr']
+# mf_returns_history also keeps the CAGR horizons mf_returns has no column for
+HISTORY_RETURN_COLUMNS = DB_RETURN_COLUMNS + ['return_ytd_cagr', 'return_1y_cagr']
+
+CREATE_RETURNS_STAGE = f"""CREATE TEMP TABLE IF NOT EXISTS {RETURNS_STAGE_TABLE} (
+                               isin varchar(12) NOT NULL,
+                               {", ".join(f"{column} double precision" for column in HISTORY_RETURN_COLUMNS)}
+                           ) ON COMMIT DELETE ROWS"""
+# returns of ISINs missing from mf_fund are dropped by the join; xmax is 0 only for freshly inserted rows
+MERGE_RETURNS = f"""WITH merged AS (
+                        INSERT INTO mf_returns (isin, {", ".join(DB_RETURN_COLUMNS)}, last_updated)
+                        SELECT s.isin, {", ".join(f"s.{column}" for column in DB_RETURN_COLUMNS)}, now() AT TIME ZONE 'utc'
+                        FROM {RETURNS_STAGE_TABLE} s JOIN mf_fund f ON f.isin = s.isin
+                        ON CONFLICT (isin) DO UPDATE
+                        SET {", ".join(f"{column} = EXCLUDED.{column}" for column in DB_RETURN_COLUMNS)},
+                            last_updated = EXCLUDED.last_updated
+                        RETURNING (xmax = 0) AS inserted)
+                    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged"""
+CLEAR_RETURNS = f"DELETE FROM mf_returns WHERE isin IN (SELECT isin FROM {RETURNS_STAGE_TABLE})"
+# a re-run for the same day replaces that day's snapshot
+MERGE_HISTORY = f"""INSERT INTO mf_returns_history (isin, as_of_date, {", ".join(HISTORY_RETURN_COLUMNS)})
+                    SELECT s.isin, %(as_of_date)s, {", ".join(f"s.{column}" for column in HISTORY_RETURN_COLUMNS)}
+                    FROM {RETURNS_STAGE_TABLE} s JOIN mf_fund f ON f.isin = s.isin
+                    ON CONFLICT (isin, as_of_date) DO UPDATE
+                    SET {", ".join(f"{column} = EXCLUDED.{column}" for column in HISTORY_RETURN_COLUMNS)}"""
+
+
+def ensure_history_partition(cursor, as_of_date):
+    """yearly range partition of mf_returns_history holding `as_of_date`"""
+    year = pd.Timestamp(as_of_date).year
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS mf_returns_history_{year} PARTITION OF mf_returns_history
+                       FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')""")
+
+
+def returns_records(df, existing_isins=None):
+    """
+    Returns file rows -> mf_returns records, built column by column
+
+    Values are coerced to floats; missing columns and non-finite values (a zero past NAV) become NULL.
+    Blank ISINs are dropped, and a repeated ISIN keeps its first row.
+    """
+    isin = df['ISIN'].astype("string").str.strip()
+    keep = isin.notna() & (isin != "") & (isin.str.lower() != "nan")
+    if existing_isins is not None:
+        keep &= isin.isin(set(existing_isins))
+    records = pd.DataFrame({'isin': isin[keep].astype(object)})
+    for column in HISTORY_RETURN_COLUMNS:
+        values = pd.to_numeric(df[column][keep], errors="coerce") if column in df else np.nan
+        records[column] = values
+    values = records[HISTORY_RETURN_COLUMNS].to_numpy(dtype=np.float64)
+    records[HISTORY_RETURN_COLUMNS] = np.where(np.isfinite(values), values, np.nan)
+    return records.drop_duplicates(subset='isin', keep='first')
+
+
+def import_returns_data(df, existing_isins=None ,clear_existing=False, as_of_date=None):
         """
-        Import fund returns data from DataFrame using bulk upsert strategy
-        
+        Import fund returns data from DataFrame with COPY into a staging table and one set-based merge
+
+        The whole universe takes a constant number of round trips: COPY, (clear,) merge, (snapshot,) commit.
+        ISINs are checked against mf_fund by the merge's join.
+
         Args:
             df: DataFrame containing returns data
-            existing_isins (set): Set of ISINs that exist in the database for validation
+            existing_isins (set): optional extra filter on the ISINs to import (mf_fund is always joined)
             clear_existing (bool): Whether to clear existing data before import
-            
+            as_of_date: also write the rows as that day's snapshot in mf_returns_history (None: current table only)
+
         Returns:
-            dict: Statistics about the import operation
+            dict: Statistics about the import operation, with per-phase timings (seconds)
         """
         logger.info(f"Importing returns data with {len(df)} records")
-
+        timings = {}
+        started = time.perf_counter()
+
+        records = returns_records(df, existing_isins)
+        timings['prepare'] = time.perf_counter() - started
+
+        stats = {
+            'returns_created': 0,
+            'returns_updated': 0,
+            'funds_not_found': 0,
+            'total_rows_processed': len(df)
+        }
+
+        if as_of_date is not None:
+            FundReturnsHistory.__table__.create(db.engine, checkfirst=True)
+        connection = db.engine.raw_connection()
         try:
-            # Clean data
-            df = df.dropna(subset=['ISIN'])
-
-            if clear_existing and len(df) > 0:
-                # Get list of ISINs to clear
-                isins = df['ISIN'].unique().tolist()
-
-                # Delete existing returns for these ISINs
-                FundReturns.query.filter(FundReturns.isin.in_(isins)).delete(
-                    synchronize_session=False)
-
-                db.session.commit()
-                logger.info(
-                    f"Cleared existing returns data for {len(isins)} ISINs")
-
-            # Track statistics
-            stats = {
-                'returns_created': 0,
-                'returns_updated': 0,
-                'funds_not_found': 0,
-                'total_rows_processed': len(df)
-            }
-
-            # Get all valid fund ISINs for validation
-            valid_fund_isins = existing_isins
-
-            # Prepare records for bulk upsert
-            returns_records = []
-
-            for _, row in df.iterrows():
-                isin = str(row['ISIN']).strip()
-
-                if not isin or isin.lower() == 'nan':
-                    continue
-
-                # Skip if fund doesn't exist
-                if isin not in valid_fund_isins:
-                    logger.warning(
-                        f"Skipping returns for {isin}: Fund not found in database"
-                    )
-                    stats['funds_not_found'] += 1
-                    continue
-
-                # Create returns record
-                returns_record = {
-                    'isin':
-                    isin,
-                    'return_1m':
-                    float(row.get('return_1w', 0)),
-
-                    'return_3m':
-                    float(row.get('return_3m', 0)),
-
-                    'return_6m':
-                    float(row.get('return_6m', 0)),
-
-                    'return_1y':
-                    float(row.get('return_1y', 0)),
-
-                    'return_3y':
-                    float(row.get('return_3y', 0)),
-
-                    'return_5y':
-                    float(row.get('return_5y', 0)),
-
-                    'return_ytd':
-                    float(row.get('return_ytd', 0)),
-
-                    'return_3y_cagr':
-                    float(row.get('return_3y_cagr', 0)),
-
-                    'return_5y_cagr':
-                    float(row.get('return_5y_cagr', 0)),
-
-                    'return_10y_cagr':
-                    float(row.get('return_10y_cagr', 0)),
-
-                    'return_since_inception':
-                    float(row.get('return_since_inception', 0)),
-
-                    'return_since_inception_cagr':
-                    float(row.get('return_since_inception_cagr', 0)),
-                    
-
-                }
-                returns_records.append(returns_record)
-
-            # Bulk upsert returns using PostgreSQL
-            if returns_records:
-                from sqlalchemy.dialects.postgresql import insert 
-
-                stmt = insert(FundReturns.__table__).values(returns_records)
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=['isin'],
-                    set_=dict(return_1m=stmt.excluded.return_1m,
-                              return_3m=stmt.excluded.return_3m,
-                              return_6m=stmt.excluded.return_6m,
-                              return_ytd=stmt.excluded.return_ytd,
-                              
-                              return_1y=stmt.excluded.return_1y,
-                              return_3y=stmt.excluded.return_3y,
-                              return_5y=stmt.excluded.return_5y,
-
-                              return_3y_cagr=stmt.excluded.return_3y_cagr,
-                              return_5y_cagr=stmt.excluded.return_5y_cagr,
-                              return_10y_cagr=stmt.excluded.return_10y_cagr,
-
-                              return_since_inception=stmt.excluded.return_since_inception,
-                              return_since_inception_cagr=stmt.excluded.return_since_inception_cagr))
-                
-                db.session.execute(stmt)
-                stats['returns_created'] = len(returns_records)
-
-            # Commit all changes
-            db.session.commit()
-            logger.info(f"Returns import completed: {stats}")
-
-            return stats
+            cursor = connection.cursor()
+            phase = time.perf_counter()
+            cursor.execute(CREATE_RETURNS_STAGE)
+            buffer = io.StringIO()
+            records.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {RETURNS_STAGE_TABLE} (isin, {', '.join(HISTORY_RETURN_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            timings['copy'] = time.perf_counter() - phase
+
+            if clear_existing:
+                phase = time.perf_counter()
+                cursor.execute(CLEAR_RETURNS)
+                logger.info(f"Cleared existing returns data for {cursor.rowcount} ISINs")
+                timings['clear'] = time.perf_counter() - phase
+
+            phase = time.perf_counter()
+            cursor.execute(MERGE_RETURNS)
+            stats['returns_created'], stats['returns_updated'] = cursor.fetchone()
+            stats['funds_not_found'] = len(records) - stats['returns_created'] - stats['returns_updated']
+            timings['merge'] = time.perf_counter() - phase
+
+            if as_of_date is not None:
+                phase = time.perf_counter()
+                ensure_history_partition(cursor, as_of_date)
+                cursor.execute(MERGE_HISTORY, {'as_of_date': pd.Timestamp(as_of_date).date()})
+                stats['history_rows'] = cursor.rowcount
+                timings['snapshot'] = time.perf_counter() - phase
+
+            phase = time.perf_counter()
+            connection.commit()
+            timings['commit'] = time.perf_counter() - phase
 
         except Exception as e:
-            db.session.rollback()
+            connection.rollback()
             logger.error(f"Error importing returns data: {e}")
             raise
+        finally:
+            connection.close()
+
+        stats['timings'] = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+        logger.info(f"Returns import completed: {stats}")
+        return stats
+
+
+def get_returns_history(isins, columns=("return_1y_cagr",), start=None, end=None):
+    """
+    Returns snapshots of `isins` between `start` and `end` (as_of_date), one row per (isin, as_of_date).
+    The date range prunes mf_returns_history down to the partitions that hold it.
+    """
+    query = f"SELECT isin, as_of_date, {', '.join(columns)} FROM mf_returns_history WHERE isin = ANY(%(isins)s)"
+    params = {'isins': list(isins)}
+    if start is not None:
+        query += " AND as_of_date >= %(start)s"
+        params['start'] = pd.Timestamp(start).date()
+    if end is not None:
+        query += " AND as_of_date <= %(end)s"
+        params['end'] = pd.Timestamp(end).date()
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query + " ORDER BY isin, as_of_date", params)
+        return pd.DataFrame(cursor.fetchall(), columns=['isin', 'as_of_date', *columns])
+    finally:
+        connection.close()
 
 
 def upsert(returns_directory="daily_returns"):
-    isis_in_db=pd.read_csv(r"c:\Users\vaibh\Downloads\studio_results_20250708_1755.csv")["isin"].to_list()
-    
     DELTA_DAYS = int(os.environ.get("DELTA_DAYS"))
-    returnsfile = os.path.join(returns_directory,f"returns_as_on {pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)}.csv")
+    as_of_date = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    returnsfile = os.path.join(returns_directory,f"returns_as_on {as_of_date}.csv")
     
     df_returns= pd.read_csv(returnsfile, sep=";")
 
@@ -192,7 +212,7 @@ def upsert(returns_directory="daily_returns"):
         print("No duplicate ISINs found.")
 
 
-    stats = import_returns_data(df_returns, existing_isins=isis_in_db, clear_existing=False)
+    stats = import_returns_data(df_returns, clear_existing=False, as_of_date=as_of_date)
     print(stats)
 
     return True
@@ -1,24 +1,25 @@
 import pandas as pd
 from bs4 import BeautifulSoup
 import requests
-import time
+from core.http_client import HttpClient
+from core.rate_limiter import HostRateLimiter
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import os
 import re
 import html
 
 directoy_path = "historical_nav"
 
-url = "https://www.amfiindia.com/net-asset-value/nav-history"
-
-res = requests.get(url)
-
-soup = BeautifulSoup(res.text, "html.parser")
-
-mfs = soup.find(id="NavHisMFName").find_all("option")
-
-mfs = pd.Series(list(map(lambda x : (x["value"], x.text),mfs)))
-
-mfs = mfs[mfs.apply(lambda x : x[0].isalnum())]
+AMFI_URL = "https://www.amfiindia.com"
+PORTAL_URL = "https://portal.amfiindia.com"
+# AMCs in flight at once, and requests per second per host shared by all of them (0 = unlimited)
+SCRAPE_WORKERS = int(os.environ.get("SCRAPE_WORKERS", 4))
+SCRAPE_RATE = float(os.environ.get("SCRAPE_RATE", 2))
+not_found_string = "No data found on the basis of selected parameters for this report"
+# characters of a window's report read before deciding whether it holds data
+PROBE_CHARS = 4096
+CHUNK_SIZE = 64 * 1024
 
 DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
 today = (pd.Timestamp.today() - pd.Timedelta(days=DELTA_DAYS)).date()
@@ -31,56 +32,107 @@ start_10y, start_5y, start_3y, start_1y, end = (back_10y.strftime("%d-%b-%Y"),
                                     back_3y.strftime("%d-%b-%Y"),
                                     back_1y.strftime("%d-%b-%Y"),
                                     today.strftime("%d-%b-%Y"))
-url_string = lambda mf_code, start, end : f"https://portal.amfiindia.com/DownloadNAVHistoryReport_Po.aspx?mf={mf_code}&frmdt={start}&todt={end}"
+# longest first: the first window with data wins
+windows = [start_10y, start_5y, start_3y, start_1y]
+url_string = lambda mf_code, start, end, portal_url=PORTAL_URL : f"{portal_url}/DownloadNAVHistoryReport_Po.aspx?mf={mf_code}&frmdt={start}&todt={end}"
 
 
-def save_to_text(mf_name, data):
+def list_amcs(client, amfi_url=AMFI_URL):
+    """(mf code, AMC name) pairs from the nav-history page's AMC drop-down"""
+    res = client.get(f"{amfi_url}/net-asset-value/nav-history")
+    soup = BeautifulSoup(res.text, "html.parser")
+    mfs = soup.find(id="NavHisMFName").find_all("option")
+    mfs = pd.Series(list(map(lambda x : (x["value"], x.text),mfs)))
+    return mfs[mfs.apply(lambda x : x[0].isalnum())]
+
+
+def open_report(client, url):
+    """starts streaming a report -> (response, text read so far, remaining text chunks) when it holds data, else None.
+        only the first `PROBE_CHARS` are read, so an empty window costs one small read"""
+    try:
+        res = client.get(url, timeout=40, stream=True)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed {url}: {e}")
+        return None
+    if not res.ok:
+        print(f"No response [{res.status_code}] {url}")
+        res.close()
+        return None
+    res.encoding = res.encoding or "utf-8"
+    chunks = res.iter_content(CHUNK_SIZE, decode_unicode=True)
+    head = ""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= PROBE_CHARS:
+            break
+    if not head.strip() or not_found_string in head:
+        res.close()
+        return None
+    return res, head, chunks
+
+
+def save_to_text(mf_name, head, chunks, output_dir=directoy_path):
+    """streams the report to `<output_dir>/<mf_name>.txt` with HTML entities unescaped, line endings untouched.
+        text after a chunk's last newline is carried into the next one so an entity is never split"""
     mf_name = re.sub(" ", "_" ,mf_name) + ".txt"
-    file_path = os.path.join(directoy_path, mf_name)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(html.unescape(str(data)))
-        
+    file_path = os.path.join(output_dir, mf_name)
+    with open(file_path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        carry = ""
+        for chunk in itertools.chain([head], chunks):
+            carry += chunk
+            cut = carry.rfind("\n") + 1
+            if cut:
+                f.write(html.unescape(carry[:cut]))
+                carry = carry[cut:]
+        f.write(html.unescape(carry))
+    os.replace(file_path + ".tmp", file_path)
     print(f"✅ done - {mf_name}")
     return True
 
-def handle_get(url):
-    try:
-        res = requests.get(url, timeout=40)
-        if res.ok:
-            return res
-    except Exception as e:
-        pass
-    return False
 
-
-def get_nav_data(pair):
+def get_nav_data(pair, client, probe_executor=None, portal_url=PORTAL_URL, output_dir=directoy_path):
+    """longest window (10y -> 5y -> 3y -> 1y) with data for one AMC, streamed to disk.
+        the 10y window is probed first, as most AMCs have data there; only on a miss are the shorter ones
+        probed - all at once with `probe_executor`, dropped after their first lines unless they win"""
     mf_code, mf_name = pair
-    time.sleep(1.5)
- 
-    not_found_string = "No data found on the basis of selected parameters for this report"
-    url = url_string(mf_code = mf_code, start = start_10y, end=end)
-    res = handle_get(url)
-    if res and not_found_string not in res.text:
-        return save_to_text(mf_name, BeautifulSoup(res.text, "html.parser"))
-    url = url_string(mf_code = mf_code, start = start_5y, end=end)
-    res = handle_get(url)
-    if res and not_found_string not in res.text:
-        return save_to_text(mf_name, BeautifulSoup(res.text, "html.parser"))
-    url = url_string(mf_code = mf_code, start = start_3y, end=end)
-    res = handle_get(url)
-    if res and not_found_string not in res.text:
-        return save_to_text(mf_name, BeautifulSoup(res.text, "html.parser"))
-    url = url_string(mf_code = mf_code, start = start_1y, end=end)
-    res = handle_get(url)
-    if res and not_found_string not in res.text:
-        return save_to_text(mf_name, BeautifulSoup(res.text, "html.parser"))
-    return False
-
-mfs= mfs
-not_available = mfs[~mfs.apply(get_nav_data)]
-
-print("data unavaible at the moment for AMC's :\n", not_available.to_list())
-
-
-
-
+    urls = [url_string(mf_code, start, end, portal_url) for start in windows]
+    chosen = open_report(client, urls[0])
+    if chosen is None and probe_executor is None:
+        for url in urls[1:]:
+            chosen = open_report(client, url)
+            if chosen:
+                break
+    elif chosen is None:
+        reports = [probe.result() for probe in [probe_executor.submit(open_report, client, url) for url in urls[1:]]]
+        chosen = next((report for report in reports if report), None)
+        for report in reports:
+            if report and report is not chosen:
+                report[0].close()
+    if chosen is None:
+        return False
+    try:
+        return save_to_text(mf_name, *chosen[1:], output_dir=output_dir)
+    finally:
+        chosen[0].close()
+
+
+def scrape(workers=SCRAPE_WORKERS, rate_limit=SCRAPE_RATE, concurrent_windows=True,
+           amfi_url=AMFI_URL, portal_url=PORTAL_URL, output_dir=directoy_path):
+    """every AMC's history report, `workers` AMCs at a time within `rate_limit` requests per second per host
+        -> the AMCs without data"""
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, int(workers))
+    client = HttpClient(pool_size=workers * len(windows), rate_limiter=HostRateLimiter(rate_limit))
+    mfs = list_amcs(client, amfi_url)
+    # window probes get their own pool so a probe never queues behind the AMC that submitted it
+    with ThreadPoolExecutor(max_workers=workers) as amc_executor, \
+         ThreadPoolExecutor(max_workers=workers * len(windows)) as probe_executor:
+        fetch = lambda pair: get_nav_data(pair, client, probe_executor if concurrent_windows else None, portal_url, output_dir)
+        done = list(amc_executor.map(fetch, mfs))
+    client.print_stats("nav-history-report")
+    return mfs[~pd.Series(done, index=mfs.index, dtype=bool)]
+
+
+if __name__ == "__main__":
+    not_available = scrape()
+    print("data unavaible at the moment for AMC's :\n", not_available.to_list())
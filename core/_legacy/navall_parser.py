@@ -0,0 +1,88 @@
+#%%
+import gzip
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from datetime import datetime
+
+# Single-pass parser for AMFI's NAVAll.txt:
+#   Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date
+#   Open Ended Schemes(Debt Scheme - Banking and PSU Fund)      <- scheme category section
+#   Aditya Birla Sun Life Mutual Fund                           <- AMC section
+#   119551;INF209KA12Z1;INF209KA13Z9;Aditya Birla Sun Life ...;105.4781;17-Oct-2025
+
+NavRecord = namedtuple("NavRecord", ["scheme_code", "isin_growth", "isin_reinvest", "scheme_name",
+                                     "nav", "date", "amc", "category"])
+
+NAVALL_COLUMNS = {
+    "scheme_code": "Scheme Code",
+    "scheme_name": "Scheme Name",
+    "isin_growth": "ISIN Div Payout/ISIN Growth",
+    "isin_reinvest": "ISIN Div Reinvestment",
+    "nav": "Net Asset Value",
+    "date": "Date",
+    "amc": "AMC",
+    "category": "Scheme Category",
+}
+
+
+def _isin(value):
+    value = value.strip()
+    return "" if value in ("-", "") else value
+
+
+def iter_navall(lines):
+    """yield a `NavRecord` per scheme line of NAVAll content (an iterable of text lines, e.g. an open file),
+        tagged with the AMC and scheme category of the section it sits in"""
+    amc = category = ""
+    dates = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(";")
+        if len(fields) < 6:
+            # section header: "... Schemes(<category>)" or the AMC name
+            if line.endswith(")") and "Schemes(" in line:
+                category = line
+            else:
+                amc = line
+            continue
+        code = fields[0].strip()
+        if not code.isdigit():
+            continue    # column header
+        try:
+            nav = float(fields[4])
+        except ValueError:
+            nav = np.nan    # "N.A."
+        raw_date = fields[5].strip()
+        date = dates.get(raw_date)
+        if date is None:
+            try:
+                date = dates[raw_date] = np.datetime64(datetime.strptime(raw_date, "%d-%b-%Y").date(), "D")
+            except ValueError:
+                date = dates[raw_date] = np.datetime64("NaT", "D")
+        yield NavRecord(int(code), _isin(fields[1]), _isin(fields[2]), fields[3].strip(), nav, date, amc, category)
+
+
+def open_navall(file_path):
+    """text handle on a NAVAll file, plain or gzip-archived (`.gz`)"""
+    if str(file_path).endswith(".gz"):
+        return gzip.open(file_path, "rt", encoding="utf-8", errors="replace")
+    return open(file_path, "r", encoding="utf-8", errors="replace")
+
+
+def parse_navall(file_path):
+    """NAVAll file (plain or `.gz`) -> columnar arrays (dict of numpy arrays keyed like `NavRecord`)"""
+    with open_navall(file_path) as f:
+        records = list(iter_navall(f))
+    columns = list(zip(*records)) if records else [()] * len(NavRecord._fields)
+    dtypes = {"scheme_code": np.int64, "nav": np.float64, "date": "datetime64[D]"}
+    return {field: np.array(values, dtype=dtypes.get(field, object))
+            for field, values in zip(NavRecord._fields, columns)}
+
+
+def read_navall(file_path):
+    """NAVAll file -> long-format frame with the NAV store column names plus `AMC` and `Scheme Category`"""
+    arrays = parse_navall(file_path)
+    return pd.DataFrame({NAVALL_COLUMNS[field]: values for field, values in arrays.items()})
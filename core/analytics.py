@@ -0,0 +1,115 @@
+#%%
+import os
+import time
+import numpy as np
+import pandas as pd
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix
+
+# Risk metrics of every scheme over trailing 1y / 3y / 5y windows of the NAV matrix.
+# The daily-return block of the longest window is built once; shorter periods are its trailing rows, and every
+# metric is a column-wise numpy reduction over all schemes at once (blocks of `ANALYTICS_BLOCK` schemes bound memory).
+
+RISK_FREE_RATE = float(os.environ.get("RISK_FREE_RATE", 0.065))   # annual, for Sharpe / Sortino
+ANALYTICS_BLOCK = int(os.environ.get("ANALYTICS_BLOCK", 4096))
+ANALYTICS_PERIODS = [("1Y", 365), ("3Y", 3 * 365), ("5Y", 5 * 365)]
+# standard deviation, drawdown and VaR are percentages; VaR is the daily loss not exceeded at that confidence
+ANALYTICS_COLUMNS = ['standard_deviation', 'sharpe_ratio', 'sortino_ratio', 'maximum_drawdown', 'calmar_ratio',
+                     'var_95', 'var_99', 'skewness', 'kurtosis']
+# fewest daily returns a period needs before its metrics are reported
+MIN_OBSERVATIONS = 20
+
+
+def window_rows(dates, as_of, days):
+    """row of the last date <= `as_of - days` (the window's base NAV) and of the last date <= `as_of`"""
+    as_of = np.datetime64(pd.Timestamp(as_of).date(), "D")
+    start, end = np.searchsorted(dates, [as_of - np.timedelta64(days, "D"), as_of], side="right") - 1
+    return int(start), int(end)
+
+
+def business_rows(dates, as_of, days):
+    """rows [start, stop) of the `days` window ending at `as_of` and the mask of its weekdays, the base row always kept
+        (weekend rows are dropped so schemes that only publish on business days are not diluted by
+        forward-filled zero returns)"""
+    start, end = window_rows(dates, as_of, days)
+    start = max(start, 0)
+    mask = np.is_busday(dates[start:end + 1])
+    if len(mask):
+        mask[0] = True   # the base row is kept so the first return has a base
+    return start, end + 1, mask
+
+
+def risk_metrics(window, days, risk_free_rate=RISK_FREE_RATE):
+    """metrics of `ANALYTICS_COLUMNS` per column of a [dates x schemes] NAV window (first row = base NAV)"""
+    returns = window[1:] / window[:-1] - 1
+    n = len(returns)
+    years = days / 365
+    per_year = n / years
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = returns.mean(axis=0)
+        dev = returns - mean
+        dev2 = dev * dev
+        m2 = dev2.mean(axis=0)
+        volatility = np.sqrt(dev2.sum(axis=0) / (n - 1) * per_year)
+        cagr = (window[-1] / window[0]) ** (1 / years) - 1
+        excess = cagr - risk_free_rate
+        target = (1 + risk_free_rate) ** (1 / per_year) - 1
+        downside = np.sqrt((np.minimum(returns - target, 0) ** 2).mean(axis=0) * per_year)
+        drawdown = (window / np.maximum.accumulate(window, axis=0) - 1).min(axis=0)
+        var_95, var_99 = -np.percentile(returns, [5, 1], axis=0)
+        metrics = {
+            'standard_deviation': volatility * 100,
+            'sharpe_ratio': excess / volatility,
+            'sortino_ratio': excess / downside,
+            'maximum_drawdown': drawdown * 100,
+            'calmar_ratio': cagr / -drawdown,
+            'var_95': var_95 * 100,
+            'var_99': var_99 * 100,
+            'skewness': (dev2 * dev).mean(axis=0) / m2 ** 1.5,
+            'kurtosis': (dev2 * dev2).mean(axis=0) / m2 ** 2 - 3,   # excess kurtosis
+        }
+    return {column: np.where(np.isfinite(values), values, np.nan) for column, values in metrics.items()}
+
+
+def compute_analytics(nav_matrix, as_of, periods=ANALYTICS_PERIODS, risk_free_rate=RISK_FREE_RATE, block=ANALYTICS_BLOCK):
+    """
+    risk metrics of every scheme for every period as of `as_of` -> long frame
+    (Scheme Code, ISIN, calculation_period, calculation_date, `ANALYTICS_COLUMNS`).
+    a scheme is reported for a period only when it has a NAV at the period's start
+    """
+    start, stop, business = business_rows(nav_matrix.dates, as_of, max(days for _, days in periods))
+    dates = nav_matrix.dates[start:stop][business]
+    growth, _ = nav_matrix.isins()
+    calculation_date = pd.Timestamp(as_of).date()
+
+    frames = []
+    for lo in range(0, len(nav_matrix.scheme_codes), block):
+        columns = slice(lo, lo + block)
+        navs = np.asarray(nav_matrix.navs[start:stop, columns], dtype=np.float64)[business]
+        for period, days in periods:
+            base, last = window_rows(dates, as_of, days)
+            if base < 0 or last - base < MIN_OBSERVATIONS:
+                continue
+            window = navs[base:last + 1]
+            eligible = np.flatnonzero(window[0] > 0)   # NaN (no NAV yet) compares False
+            if len(eligible) == 0:
+                continue
+            metrics = risk_metrics(window[:, eligible], days, risk_free_rate)
+            frame = pd.DataFrame(metrics, columns=ANALYTICS_COLUMNS)
+            frame.insert(0, 'Scheme Code', nav_matrix.scheme_codes[columns][eligible])
+            frame.insert(1, 'ISIN', growth[columns][eligible])
+            frame.insert(2, 'calculation_period', period)
+            frame.insert(3, 'calculation_date', calculation_date)
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['Scheme Code', 'ISIN', 'calculation_period', 'calculation_date'] + ANALYTICS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+#%%
+if __name__ == "__main__":
+    DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
+    as_of = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    start = time.perf_counter()
+    analytics = compute_analytics(NavMatrix.load(NAV_MATRIX_PATH), as_of)
+    print(f"{len(analytics)} scheme-periods as of {as_of} in {time.perf_counter() - start:.2f}s")
+    print(analytics.groupby('calculation_period')[ANALYTICS_COLUMNS].median().T)
@@ -0,0 +1,69 @@
+#%%
+# Benchmark: legacy per-horizon calculate_returns vs the single-gather engine in core.calculator
+#   python -m core.bench_calculator --schemes 16000 --years 10
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from core.calculator import calculate_returns
+from core._legacy.calculator import calculate_returns as legacy_calculate_returns
+
+
+def synthetic_history(n_schemes=2000, years=10, seed=0):
+    """long-format NAV history shaped like the consolidated store: schemes launched at random dates,
+        one NAV per calendar day (so every horizon date exists and the legacy engine never inserts rows)"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=years * 365, freq="D")
+    launch = rng.integers(0, len(dates) - 30, n_schemes)
+    lengths = len(dates) - launch
+    codes = np.repeat(np.arange(100000, 100000 + n_schemes), lengths)
+    date_idx = np.concatenate([np.arange(start, len(dates)) for start in launch])
+    steps = rng.normal(0.0003, 0.01, len(codes))
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    log_nav = np.cumsum(steps)
+    log_nav -= np.repeat(log_nav[starts], lengths)
+    names = np.array([f"Scheme {i}" for i in range(n_schemes)], dtype=object)
+    growth = np.array([f"INF{i:09d}" for i in range(n_schemes)], dtype=object)
+    return pd.DataFrame({
+        "Scheme Code": codes,
+        "Scheme Name": names[codes - 100000],
+        "ISIN Div Payout/ISIN Growth": growth[codes - 100000],
+        "ISIN Div Reinvestment": "",
+        "Net Asset Value": np.round(10 * np.exp(log_nav), 4),
+        "Date": dates[date_idx].strftime("%Y-%m-%d"),
+    })
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(n_schemes=2000, years=10, seed=0):
+    df = synthetic_history(n_schemes, years, seed)
+    print(f"history: {len(df):,} rows | {n_schemes} schemes | {years} years")
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, "legacy.csv")
+        new_file = os.path.join(tmp, "new.csv")
+        legacy_seconds = timed(legacy_calculate_returns, df, legacy_file)
+        new_seconds = timed(calculate_returns, df, new_file)
+        with open(legacy_file, "rb") as a, open(new_file, "rb") as b:
+            identical = a.read() == b.read()
+    print(f"legacy : {legacy_seconds:8.2f}s")
+    print(f"vector : {new_seconds:8.2f}s")
+    print(f"speedup: {legacy_seconds / new_seconds:8.1f}x | identical csv: {identical}")
+    return legacy_seconds, new_seconds, identical
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.schemes, args.years, args.seed)
@@ -0,0 +1,86 @@
+#%%
+# Benchmark: serial vs concurrent HistoricalNAVDownloader against the local stub server (no network)
+#   python -m core.bench_downloader --schemes 200 --workers 16 --rate 50 --latency 0.05
+import argparse
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+import requests
+
+from core.historical_downloader_updated import HistoricalNAVDownloader
+
+
+def spawn_stub_server(port=8765, latency=0.05, fail_rate=0.0):
+    """run the stub in its own process so serving responses does not compete with the downloader for the GIL"""
+    process = subprocess.Popen([sys.executable, "-m", "core.stub_amfi_server", "--port", str(port), "--latency", str(latency),
+                                "--fail-rate", str(fail_rate)],
+                               stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base_url}/_stats", timeout=1)
+            return process, base_url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"stub server did not start on {base_url}")
+
+
+def synthetic_scheme_data(path, n_schemes=200):
+    """scheme master in the layout of the BSE scheme data sheet the downloader reads"""
+    pd.DataFrame({
+        "Code": range(100000, 100000 + n_schemes),
+        "Scheme NAV Name": [f"Scheme {i}" for i in range(n_schemes)],
+        "ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment": [f"INF{i:09d}" for i in range(n_schemes)],
+    }).to_csv(path, index=False)
+    return path
+
+
+def run(base_url, scheme_file, output_folder, workers, rate, years):
+    downloader = HistoricalNAVDownloader(path_BSESchemeData=scheme_file, path_output_folder=output_folder,
+                                         years_back=years, workers=workers, rate_limit=rate, base_url=base_url,
+                                         journal=False, registry_path=None)
+    requests.get(f"{base_url}/_reset")
+    start = time.perf_counter()
+    downloader.get_all_from_scheme_data()
+    seconds = time.perf_counter() - start
+    stats = requests.get(f"{base_url}/_stats").json()
+    times = pd.Series(stats["request_times"], dtype=float)
+    peak_rate = int((times // 1).value_counts().max()) if len(times) else 0
+    return seconds, stats["requests"], stats["connections"], stats["max_in_flight"], peak_rate
+
+
+def main(n_schemes=200, workers=16, rate=50.0, latency=0.05, years=10, port=8765, fail_rate=0.0):
+    server, base_url = spawn_stub_server(port, latency, fail_rate)
+    with tempfile.TemporaryDirectory() as tmp:
+        scheme_file = synthetic_scheme_data(os.path.join(tmp, "schemes.csv"), n_schemes)
+        serial_dir, concurrent_dir = os.path.join(tmp, "serial"), os.path.join(tmp, "concurrent")
+        serial = run(base_url, scheme_file, serial_dir, 1, None, years)
+        concurrent = run(base_url, scheme_file, concurrent_dir, workers, rate, years)
+        files = sorted(os.listdir(serial_dir))
+        _, mismatch, errors = filecmp.cmpfiles(serial_dir, concurrent_dir, files, shallow=False)
+        identical = files == sorted(os.listdir(concurrent_dir)) and not mismatch and not errors
+    server.terminate()
+    for label, (seconds, requests, connections, in_flight, peak) in (("serial", serial), (f"{workers} workers", concurrent)):
+        print(f"{label:>12}: {seconds:7.2f}s | {requests} requests over {connections} connections | {requests / seconds:7.1f} req/s | "
+              f"max in flight {in_flight} | peak {peak} req in one second")
+    print(f"speedup: {serial[0] / concurrent[0]:.1f}x | identical files: {identical} | rate limit {rate} req/s")
+    return serial, concurrent, identical
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schemes", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=50.0, help="requests per second per host")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response delay in seconds")
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of stub responses that are 503s")
+    args = parser.parse_args()
+    main(args.schemes, args.workers, args.rate, args.latency, args.years, args.port, args.fail_rate)
@@ -0,0 +1,81 @@
+#%%
+# Benchmark: NAVAll parsing - read_csv + isdigit cleanup (the old update_latest_nav) and the per-line
+# parser vs the vectorised core.navall_parser, on a synthetic NAVAll shaped like AMFI's
+#   python -m core.bench_navall --schemes 16000
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from core.navall_parser import NAVALL_FIELDS, parse_navall
+from core._legacy.navall_parser import parse_navall as line_parse_navall
+
+HEADER = "Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date"
+
+
+def synthetic_navall(n_schemes=16000, n_amcs=45, n_categories=30, seed=0):
+    """NAVAll text: category sections, AMC sub-sections, blank separator lines, '-' ISINs and N.A. NAVs"""
+    rng = np.random.default_rng(seed)
+    date = pd.Timestamp.today().strftime("%d-%b-%Y")
+    lines = [HEADER, ""]
+    code = 100000
+    per_section = max(1, n_schemes // (n_amcs * n_categories))
+    while code < 100000 + n_schemes:
+        for c in range(n_categories):
+            lines += [f"Open Ended Schemes(Equity Scheme - Category {c})", ""]
+            for a in range(n_amcs):
+                lines += [f"AMC {a} Mutual Fund", ""]
+                for _ in range(per_section):
+                    if code >= 100000 + n_schemes:
+                        break
+                    nav = "N.A." if rng.random() < 0.01 else f"{rng.uniform(10, 500):.4f}"
+                    reinvest = "-" if rng.random() < 0.5 else f"INF{code:06d}R01"
+                    lines.append(f"{code};INF{code:06d}G01;{reinvest};AMC {a} Scheme {code} - Growth;{nav};{date}")
+                    code += 1
+                lines.append("")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def read_csv_navall(file_path):
+    """the old update_latest_nav read: read_csv, then drop every line whose Scheme Code is not all digits"""
+    df = pd.read_csv(file_path, delimiter=";")[["Scheme Code", "Scheme Name", "ISIN Div Payout/ ISIN Growth",
+                                                 "ISIN Div Reinvestment", "Net Asset Value", "Date"]]
+    df = df.drop(df[~df["Scheme Code"].fillna("-").astype(str).apply(lambda x: x.isdigit())].index)
+    df["Scheme Code"] = df["Scheme Code"].astype(int)
+    return df
+
+
+def timed(fn, *args, repeat=5):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(n_schemes=16000, seed=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "NAVAll.txt")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(synthetic_navall(n_schemes, seed=seed))
+        csv_seconds, _ = timed(read_csv_navall, path)
+        line_seconds, old = timed(line_parse_navall, path)
+        new_seconds, new = timed(parse_navall, path)
+    identical = all(np.array_equal(old[field], new[field], equal_nan=field == "nav") for field in NAVALL_FIELDS)
+    print(f"NAVAll: {len(new['scheme_code']):,} schemes")
+    print(f"read_csv + cleanup : {csv_seconds * 1000:8.1f} ms (no AMC / category)")
+    print(f"per-line parser    : {line_seconds * 1000:8.1f} ms")
+    print(f"vectorised parser  : {new_seconds * 1000:8.1f} ms | same records as per-line: {identical}")
+    return csv_seconds, line_seconds, new_seconds, identical
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schemes", type=int, default=16000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.schemes, args.seed)
@@ -0,0 +1,159 @@
+#%%
+import os
+import time
+import numpy as np
+import pandas as pd
+from core.analytics import ANALYTICS_PERIODS, MIN_OBSERVATIONS, RISK_FREE_RATE, business_rows, window_rows
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix
+
+# Benchmark-relative metrics (beta, alpha, Treynor, tracking error, information ratio, R², capture ratios).
+# Schemes are grouped by the index they are benchmarked against; within a group every metric is one matrix
+# operation over the group's [dates x schemes] return block against the one index series, so the covariance
+# with the index is computed once per benchmark and period, never per fund.
+#
+# Index closes are read from a local file (csv or parquet) in long format: Date, Index Name, Close.
+# Index names are matched with FundFactSheet.benchmark case- and whitespace-insensitively.
+
+BENCHMARK_PATH = os.environ.get("BENCHMARK_PATH", "benchmark_index.csv")
+# alpha, tracking error and the capture ratios are percentages; alpha is Jensen's alpha on annualised returns
+BENCHMARK_COLUMNS = ['beta', 'alpha', 'treynor_ratio', 'tracking_error', 'information_ratio', 'r_squared',
+                     'up_capture_ratio', 'down_capture_ratio']
+
+
+def benchmark_key(name):
+    """index name as matched between the index file and the factsheets"""
+    return " ".join(str(name).upper().split())
+
+
+def load_benchmarks(path=BENCHMARK_PATH):
+    """index file -> dates x index closes frame (columns: index names as written in the file)"""
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, columns=['Date', 'Index Name', 'Close'])
+    else:
+        df = pd.read_csv(path, usecols=['Date', 'Index Name', 'Close'])
+    df['Date'] = pd.to_datetime(df['Date'], format="mixed", dayfirst=True)
+    df['Index Name'] = df['Index Name'].str.strip()
+    df['Close'] = pd.to_numeric(df['Close'], errors="coerce")
+    return df.pivot_table(index='Date', columns='Index Name', values='Close', aggfunc="last").sort_index()
+
+
+def align_benchmarks(benchmarks, dates):
+    """index closes on the NAV matrix `dates`, carried over index holidays but never past an index's last close"""
+    dates = pd.DatetimeIndex(dates)
+    aligned = benchmarks.reindex(benchmarks.index.union(dates)).ffill().reindex(dates)
+    last_close = benchmarks.apply(pd.Series.last_valid_index)
+    return aligned.where(dates.to_numpy()[:, None] <= last_close.to_numpy(dtype="datetime64[ns]")[None, :])
+
+
+def relative_metrics(window, index, days, risk_free_rate=RISK_FREE_RATE):
+    """
+    metrics of `BENCHMARK_COLUMNS` per column of a [dates x schemes] NAV window against the `index` closes
+    on the same rows (first row = base)
+    """
+    returns = window[1:] / window[:-1] - 1
+    market = index[1:] / index[:-1] - 1
+    n = len(returns)
+    years = days / 365
+    per_year = n / years
+    with np.errstate(divide="ignore", invalid="ignore"):
+        market_dev = market - market.mean()
+        dev = returns - returns.mean(axis=0)
+        market_var = market_dev @ market_dev / (n - 1)
+        covariance = market_dev @ dev / (n - 1)   # the one covariance of the group: [n] @ [n x schemes]
+        variance = (dev * dev).sum(axis=0) / (n - 1)
+        beta = covariance / market_var
+        cagr = (window[-1] / window[0]) ** (1 / years) - 1
+        market_cagr = (index[-1] / index[0]) ** (1 / years) - 1
+        active = returns - market[:, None]
+        tracking_error = active.std(axis=0, ddof=1) * np.sqrt(per_year)
+        up, down = market > 0, market < 0
+        metrics = {
+            'beta': beta,
+            'alpha': ((cagr - risk_free_rate) - beta * (market_cagr - risk_free_rate)) * 100,
+            'treynor_ratio': (cagr - risk_free_rate) / beta,
+            'tracking_error': tracking_error * 100,
+            'information_ratio': (cagr - market_cagr) / tracking_error,
+            'r_squared': covariance ** 2 / (variance * market_var) * 100,
+            # mean fund return on the index's up (down) days over the index's mean return on them
+            'up_capture_ratio': (up @ returns / up.sum()) / market[up].mean() * 100,
+            'down_capture_ratio': (down @ returns / down.sum()) / market[down].mean() * 100,
+        }
+    return {column: np.where(np.isfinite(values), values, np.nan) for column, values in metrics.items()}
+
+
+def compute_benchmark_analytics(nav_matrix, benchmarks, fund_benchmarks, as_of, periods=ANALYTICS_PERIODS,
+                                risk_free_rate=RISK_FREE_RATE):
+    """
+    benchmark-relative metrics of every fund with a known benchmark, for every period as of `as_of` -> long frame
+    (Scheme Code, ISIN, calculation_period, calculation_date, `BENCHMARK_COLUMNS`, benchmark_index).
+    `benchmarks` is a frame of `load_benchmarks`, `fund_benchmarks` maps ISIN (either of a scheme's) -> benchmark name.
+    a fund is reported for a period only when both it and its index have a value at the period's start
+    """
+    start, stop, business = business_rows(nav_matrix.dates, as_of, max(days for _, days in periods))
+    dates = nav_matrix.dates[start:stop][business]
+    index_names = {benchmark_key(name): name for name in benchmarks.columns}
+    closes = align_benchmarks(benchmarks, dates)
+    calculation_date = pd.Timestamp(as_of).date()
+
+    funds = pd.DataFrame({'ISIN': fund_benchmarks.index.astype(str), 'benchmark': fund_benchmarks.to_numpy()})
+    funds['index'] = funds['benchmark'].map(lambda name: index_names.get(benchmark_key(name)) if isinstance(name, str) else None)
+    funds['column'] = nav_matrix.columns(isins=funds['ISIN'])
+    unmatched = funds['index'].isna() & funds['benchmark'].notna()
+    if unmatched.any():
+        print(f"{unmatched.sum()} funds with a benchmark missing from the index file, e.g. "
+              f"{funds.loc[unmatched, 'benchmark'].drop_duplicates().head(5).to_list()}")
+    funds = funds[funds['index'].notna() & (funds['column'] >= 0)].copy()
+    # a factsheet may name the reinvestment ISIN: rows are keyed by the scheme's growth ISIN, like `compute_analytics`,
+    # and a scheme with factsheets under both of its ISINs is computed once (its growth ISIN's benchmark first)
+    growth, _ = nav_matrix.isins()
+    canonical = growth[funds['column'].to_numpy()]
+    funds['canonical'] = funds['ISIN'] == canonical
+    funds['ISIN'] = np.where(canonical != "", canonical, funds['ISIN'].to_numpy())
+    funds = funds.sort_values('canonical', ascending=False, kind="stable").drop_duplicates('column')
+
+    # one read of the window for every benchmarked fund; groups index into it
+    columns = np.unique(funds['column'].to_numpy())
+    navs = np.asarray(nav_matrix.navs[start:stop, columns], dtype=np.float64)[business]
+    funds['position'] = np.searchsorted(columns, funds['column'].to_numpy())
+
+    frames = []
+    for index_name, group in funds.groupby('index', sort=False):
+        series = closes[index_name].to_numpy(dtype=np.float64)
+        block = navs[:, group['position'].to_numpy()]
+        for period, days in periods:
+            base, last = window_rows(dates, as_of, days)
+            if base < 0 or last - base < MIN_OBSERVATIONS:
+                continue
+            index = series[base:last + 1]
+            if not (index > 0).all():   # index not yet listed, or not published up to `as_of`
+                continue
+            window = block[base:last + 1]
+            eligible = np.flatnonzero(window[0] > 0)   # NaN (no NAV yet) compares False
+            if len(eligible) == 0:
+                continue
+            metrics = relative_metrics(window[:, eligible], index, days, risk_free_rate)
+            frame = pd.DataFrame(metrics, columns=BENCHMARK_COLUMNS)
+            frame.insert(0, 'Scheme Code', nav_matrix.scheme_codes[group['column'].to_numpy()[eligible]])
+            frame.insert(1, 'ISIN', group['ISIN'].to_numpy()[eligible])
+            frame.insert(2, 'calculation_period', period)
+            frame.insert(3, 'calculation_date', calculation_date)
+            frame['benchmark_index'] = index_name[:50]
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['Scheme Code', 'ISIN', 'calculation_period', 'calculation_date']
+                            + BENCHMARK_COLUMNS + ['benchmark_index'])
+    return pd.concat(frames, ignore_index=True)
+
+
+#%%
+if __name__ == "__main__":
+    # python -m core.benchmarks <factsheet export with ISIN / benchmark columns>
+    import sys
+    DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
+    as_of = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    factsheet = pd.read_csv(sys.argv[1])
+    fund_benchmarks = factsheet.set_index(factsheet.columns[0])['benchmark']
+    start = time.perf_counter()
+    analytics = compute_benchmark_analytics(NavMatrix.load(NAV_MATRIX_PATH), load_benchmarks(), fund_benchmarks, as_of)
+    print(f"{len(analytics)} fund-periods as of {as_of} in {time.perf_counter() - start:.2f}s")
+    print(analytics.groupby(['benchmark_index', 'calculation_period'])[BENCHMARK_COLUMNS].median())
@@ -2,132 +2,208 @@
 import pandas as pd
 import numpy as np
 import os
+import time
+import pyarrow as pa
+import pyarrow.dataset as ds
+from core.nav_store import NAV_STORE_PATH, read_nav_store
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix, first_valid_rows
 
 # df = pd.read_csv("nav_time_series.csv",delimiter=";").dropna()
 # return_file_path = "returns_test.csv"
 
-ROUND_DECIMALS = 6 
-
-def calculate_returns(df, return_file_path="returns_simple.csv"):
-    DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
-    TODAY= pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
-    
-    df = df.copy()
-    df['Date'] = df['Date'].apply(lambda x: pd.Timestamp(x).date())
-    # Step 1: Aggregate duplicate NAV entries (use mean or last as needed)
-    df_grouped = df.groupby(['Date', 'Scheme Code'], as_index=False)['Net Asset Value'].mean()
-    # Step 2: Pivot NAVs: rows = dates, columns = scheme codes
-    nav_wide = df_grouped.pivot(index='Date', columns='Scheme Code', values='Net Asset Value').sort_index()
-    # Step 3: Get latest NAV (forward fill missing NAVs)
-    nav_wide = nav_wide.ffill()
-    _latest_date = nav_wide.index[-1]
-    if(_latest_date > TODAY):
-        if TODAY not in nav_wide.index:
-            nav_wide.loc[TODAY] = pd.NA
-            nav_wide = nav_wide.sort_index().ffill()
-        _latest_date = TODAY
-        
-    latest_nav = nav_wide.loc[_latest_date]
-
-    formula_simple = lambda latest_nav, past_nav : round(((latest_nav - past_nav) / past_nav * 100), ROUND_DECIMALS)
-    formula_cagr = lambda latest_nav, past_nav, years : round(((latest_nav / past_nav) ** (1 / years) - 1) *100, ROUND_DECIMALS)
-
-    debug_isin = None
-
-    def compute_return_simple(delta_days, nav_wide):
-        past_date = TODAY - pd.Timedelta(days=delta_days)
-        if past_date < nav_wide.index[0]:
-            return pd.Series([None] * len(latest_nav), index=latest_nav.index)
-        if past_date not in nav_wide.index:
-            nav_wide.loc[past_date] = pd.NA
-            nav_wide = nav_wide.sort_index().ffill()
-        past_nav = nav_wide.loc[past_date]
-
-        ret =  formula_simple(latest_nav , past_nav)
-        if debug_isin:
-            print(past_date)
-            print(past_nav.loc[debug_isin])
-            print(ret.loc[debug_isin])
-            print(latest_nav.loc[debug_isin])
-        return ret
-    
-    def compute_return_cagr(delta_days, nav_wide):
-        years = delta_days/365
-        past_date = TODAY - pd.Timedelta(days=delta_days)
-        if past_date < nav_wide.index[0]:
-            return pd.Series([None] * len(latest_nav), index=latest_nav.index)
-        if past_date not in nav_wide.index:
-            nav_wide.loc[past_date] = pd.NA
-            nav_wide = nav_wide.sort_index().ffill()
-        past_nav = nav_wide.loc[past_date]
-        ret = formula_cagr(latest_nav, past_nav, years)
-        if debug_isin:
-            print(past_date)
-            print(past_nav.loc[debug_isin])
-            print(ret.loc[debug_isin])
-            print(latest_nav.loc[debug_isin])
-        return ret
-
-    
-
-    returns = pd.DataFrame({
-        'return_1m': compute_return_simple(30,nav_wide),
-        'return_3m': compute_return_simple(3*30,nav_wide),
-        'return_6m': compute_return_simple(6*30,nav_wide),
-        'return_1y': compute_return_simple(365,nav_wide),
-        'return_3y': compute_return_simple(3 * 365,nav_wide),
-        'return_5y': compute_return_simple(5 * 365,nav_wide),
-
-        'return_1y_cagr': compute_return_cagr(365, nav_wide),
-        'return_3y_cagr': compute_return_cagr(3 * 365, nav_wide),
-        'return_5y_cagr': compute_return_cagr(5 * 365, nav_wide),
-        'return_10y_cagr': compute_return_cagr(10* 365, nav_wide),
-    })
-
-    # YTD
-    current_year_start = pd.Timestamp(f"{pd.Timestamp.today().year}-01-01").date()
-    today = TODAY
-    days = (today - current_year_start).days
-    returns["return_ytd"] = compute_return_simple(days, nav_wide)
-    returns["return_ytd_cagr"] = compute_return_cagr(days, nav_wide)
-
-    # total returns - since the day of first record
-    first_indexes = nav_wide.apply(lambda col: col.first_valid_index())
-    first_values = pd.Series({col: nav_wide.at[idx, col] for col, idx in first_indexes.items()})
-    today = TODAY
-    # print(first_indexes[153324])
-    # print(first_values[153324])
-    # print(first_indexes.apply(lambda d: (today - d).days).loc[153324])
-    # print(latest_nav[153324])
-    delta_years =first_indexes.apply(lambda d: (today - d).days) / 365
-
-    returns["return_since_inception"] = formula_simple(latest_nav, first_values)
-    returns["return_since_inception_cagr"] = formula_cagr(latest_nav, first_values, delta_years)
-
-
-    # Merge with metadata (Scheme Name + ISINs)
-    latest_meta = df.sort_values('Date').groupby('Scheme Code').last()[[
-        'Scheme Name', 'ISIN Div Payout/ISIN Growth', 'ISIN Div Reinvestment'
-    ]]
+ROUND_DECIMALS = 6
+
+# column, days back from the as-of date ("ytd" = since 1st January of the as-of year), annualised (CAGR)
+RETURN_HORIZONS = [
+    ("return_1m",        30,        False),
+    ("return_3m",        3 * 30,    False),
+    ("return_6m",        6 * 30,    False),
+    ("return_1y",        365,       False),
+    ("return_3y",        3 * 365,   False),
+    ("return_5y",        5 * 365,   False),
+    ("return_1y_cagr",   365,       True),
+    ("return_3y_cagr",   3 * 365,   True),
+    ("return_5y_cagr",   5 * 365,   True),
+    ("return_10y_cagr",  10 * 365,  True),
+    ("return_ytd",       "ytd",     False),
+    ("return_ytd_cagr",  "ytd",     True),
+]
+
+RETURN_COLUMNS = ['return_1m','return_3m', 'return_6m', 'return_1y','return_3y','return_5y', 'return_ytd', 'return_ytd_cagr','return_1y_cagr','return_3y_cagr', 'return_5y_cagr', 'return_10y_cagr','return_since_inception','return_since_inception_cagr']
+
+META_COLUMNS = ['ISIN Div Payout/ISIN Growth', 'ISIN Div Reinvestment', 'Scheme Code', 'Scheme Name']
+
+# as-of dates resolved per gather in a backfill (memory ~ block x 13 x schemes x 8 bytes)
+RETURNS_BLOCK = int(os.environ.get("RETURNS_BLOCK", 32))
+
+
+def formula_simple(latest_nav, past_nav):
+    return np.round((latest_nav - past_nav) / past_nav * 100, ROUND_DECIMALS)
+
+def formula_cagr(latest_nav, past_nav, years):
+    return np.round(((latest_nav / past_nav) ** (1 / years) - 1) * 100, ROUND_DECIMALS)
+
+
+def asof_rows(dates, targets):
+    """row of the last date <= each target (-1 when the target precedes the history)"""
+    return np.searchsorted(dates, targets, side="right") - 1
+
+
+def take_rows(navs, rows):
+    """gather `rows` of the NAV matrix in one go; rows of -1 come back as NaN"""
+    rows = np.asarray(rows)
+    out = navs[np.maximum(rows, 0)]
+    out[rows < 0] = np.nan
+    return out
+
+
+def horizons_days(as_of_dates):
+    """[as-of dates x horizons] days back of every horizon of `RETURN_HORIZONS` ("ytd" differs per date)"""
+    since_new_year = (as_of_dates - as_of_dates.astype("datetime64[Y]").astype("datetime64[D]")).astype(np.int64)
+    return np.stack([since_new_year if horizon == "ytd" else np.full(len(as_of_dates), horizon, dtype=np.int64)
+                     for _, horizon, _ in RETURN_HORIZONS], axis=1)
+
+
+def compute_returns_block(navs, dates, as_of_dates, first_rows):
+    """every horizon of `RETURN_HORIZONS` (+ since inception) for each of `as_of_dates` -> {column: [dates x schemes]}.
+        the look-up rows of every date and horizon are resolved with one searchsorted and one row gather."""
+    as_of_dates = np.asarray(as_of_dates, dtype="datetime64[D]")
+    days = horizons_days(as_of_dates)
+    targets = np.concatenate([as_of_dates[:, None], as_of_dates[:, None] - days.astype("timedelta64[D]")], axis=1)
+    rows = asof_rows(dates, targets.ravel())
+    gathered = take_rows(navs, rows).reshape(len(as_of_dates), len(RETURN_HORIZONS) + 1, -1)
+    latest_nav = gathered[:, 0]
+
+    returns = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for h, (column, _, cagr) in enumerate(RETURN_HORIZONS):
+            past_nav, delta = gathered[:, h + 1], days[:, h:h + 1]
+            if cagr:
+                returns[column] = np.where(delta > 0, formula_cagr(latest_nav, past_nav, delta / 365), np.nan)
+            else:
+                returns[column] = formula_simple(latest_nav, past_nav)
+
+        # total returns - since the day of first record
+        columns = np.arange(navs.shape[1])
+        first_values = np.asarray(navs[np.maximum(first_rows, 0), columns], dtype=np.float64)
+        first_values[first_rows < 0] = np.nan
+        delta_years = (as_of_dates[:, None] - dates[np.maximum(first_rows, 0)][None, :]).astype(np.int64) / 365
+        returns["return_since_inception"] = formula_simple(latest_nav, first_values)
+        returns["return_since_inception_cagr"] = formula_cagr(latest_nav, first_values, delta_years)
+    return returns
+
+
+def compute_returns_range(navs, dates, scheme_codes, as_of_dates, first_rows=None, block=RETURNS_BLOCK):
+    """(as-of date, returns frame) for each of `as_of_dates`, `block` dates per gather"""
+    if first_rows is None:
+        first_rows = first_valid_rows(navs)
+    as_of_dates = np.asarray([np.datetime64(pd.Timestamp(d).date(), "D") for d in as_of_dates], dtype="datetime64[D]")
+    index = pd.Index(scheme_codes, name='Scheme Code')
+    for lo in range(0, len(as_of_dates), block):
+        chunk = as_of_dates[lo:lo + block]
+        returns = compute_returns_block(navs, dates, chunk, first_rows)
+        for i, as_of in enumerate(chunk):
+            yield as_of.astype(object), pd.DataFrame({column: values[i] for column, values in returns.items()},
+                                                     index=index)[RETURN_COLUMNS]
+
+
+def compute_returns(navs, dates, scheme_codes, as_of, first_rows=None):
+    """every horizon of `RETURN_HORIZONS` (+ since inception) as of `as_of` from a forward-filled NAV matrix"""
+    return next(compute_returns_range(navs, dates, scheme_codes, [as_of], first_rows))[1]
+
+
+def calculate_returns(df=None, return_file_path="returns_simple.csv", nav_store_path=NAV_STORE_PATH, nav_matrix=None,
+                      as_of=None):
+    """returns as of `as_of` (default: today - DELTA_DAYS).
+        `nav_matrix` (persisted `NavMatrix`) is used when given, otherwise the matrix is built from `df`,
+        the long-format NAV history, which is read from the NAV store when omitted."""
+    if as_of is None:
+        DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
+        as_of = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    TODAY = pd.Timestamp(as_of).date()
+
+    if nav_matrix is None:
+        if df is None:
+            df = read_nav_store(nav_store_path)
+        # Pivot NAVs: rows = dates, columns = scheme codes (duplicates averaged, gaps forward filled once)
+        nav_matrix = NavMatrix.from_history(df)
 
+    returns = compute_returns(nav_matrix.navs, nav_matrix.dates, nav_matrix.scheme_codes, TODAY,
+                              first_rows=nav_matrix.first_rows).sort_index()
+
+    return write_returns(returns, nav_matrix.meta, return_file_path)
+
+
+def returns_table(returns, latest_meta):
     # Merge returns with metadata
     result_df = returns.merge(latest_meta, left_index=True, right_index=True)
     result_df = result_df.reset_index()  # Scheme Code becomes column again
     # Sort by Total Return
     result_df = result_df.sort_values('return_since_inception_cagr', ascending=False)
 
-    # Format return values as percentage strings
-    return_cols = ['return_1m','return_3m', 'return_6m', 'return_1y','return_3y','return_5y', 'return_ytd', 'return_ytd_cagr','return_1y_cagr','return_3y_cagr', 'return_5y_cagr', 'return_10y_cagr','return_since_inception','return_since_inception_cagr']
-
     # Arrange final column order
-    final_cols = [
-        'ISIN Div Payout/ISIN Growth', 'ISIN Div Reinvestment',
-        'Scheme Code', 'Scheme Name'
-    ] + return_cols
+    total_returns_df = result_df[META_COLUMNS + RETURN_COLUMNS]
+    return total_returns_df[~total_returns_df.duplicated(subset=["ISIN Div Payout/ISIN Growth"], keep=False)]
 
-    total_returns_df = result_df[final_cols]
-    total_returns_df = total_returns_df[~total_returns_df.duplicated(subset=["ISIN Div Payout/ISIN Growth"], keep=False)]
+
+def write_returns(returns, latest_meta, return_file_path):
+    total_returns_df = returns_table(returns, latest_meta)
     # Save to CSV using semicolon as delimiter
     total_returns_df.to_csv(return_file_path, index=False, sep=";")
 
     return total_returns_df
+
+
+def write_returns_dataset(tables, dataset_path):
+    """(as-of date, returns table) pairs -> hive-partitioned parquet dataset (as_of_date=YYYY-MM-DD);
+        the partitions of the dates written are replaced, the others are kept"""
+    frames = [table.assign(as_of_date=str(as_of)) for as_of, table in tables]
+    if not frames:
+        return 0
+    table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), preserve_index=False)
+    ds.write_dataset(table, dataset_path, format="parquet",
+                     partitioning=ds.partitioning(pa.schema([("as_of_date", pa.string())]), flavor="hive"),
+                     basename_template="returns-{i}.parquet", existing_data_behavior="delete_matching")
+    return table.num_rows
+
+
+def backfill_returns(start, end=None, nav_matrix=None, returns_directory="daily_returns/", dataset_path=None,
+                     nav_matrix_path=NAV_MATRIX_PATH, block=RETURNS_BLOCK):
+    """
+    returns snapshots for every calendar day in [start, end] from one pass over the NAV matrix:
+    one `returns_as_on <date>.csv` per day in `returns_directory` (the daily run's file), or, with
+    `dataset_path`, a single parquet dataset partitioned by as_of_date.
+    days past the matrix's last NAV date are not computed. -> number of snapshots written
+    """
+    if nav_matrix is None:
+        nav_matrix = NavMatrix.load(nav_matrix_path)
+    last = pd.Timestamp(nav_matrix.dates[-1])
+    end = min(pd.Timestamp(end or last), last)
+    as_of_dates = pd.date_range(max(pd.Timestamp(start), pd.Timestamp(nav_matrix.dates[0])), end, freq="D")
+    snapshots = compute_returns_range(nav_matrix.navs, nav_matrix.dates, nav_matrix.scheme_codes, as_of_dates,
+                                      first_rows=nav_matrix.first_rows, block=block)
+    started = time.perf_counter()
+    if dataset_path is not None:
+        rows = write_returns_dataset(((as_of, returns_table(returns.sort_index(), nav_matrix.meta))
+                                      for as_of, returns in snapshots), dataset_path)
+        print(f"{len(as_of_dates)} snapshots ({rows} rows) written to {dataset_path} in {time.perf_counter() - started:.2f}s")
+    else:
+        os.makedirs(returns_directory, exist_ok=True)
+        for as_of, returns in snapshots:
+            write_returns(returns.sort_index(), nav_matrix.meta,
+                          os.path.join(returns_directory, f"returns_as_on {as_of}.csv"))
+        print(f"{len(as_of_dates)} snapshots written to {returns_directory} in {time.perf_counter() - started:.2f}s")
+    return len(as_of_dates)
+
+
+#%%
+if __name__ == "__main__":
+    # python -m core.calculator --from 2024-01-01 [--to 2024-12-31] [--dataset daily_returns_dataset]
+    import argparse
+    parser = argparse.ArgumentParser(description="backfill daily returns snapshots from the NAV matrix")
+    parser.add_argument("--from", dest="start", required=True, help="first as-of date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", default=None, help="last as-of date (default: the matrix's last date)")
+    parser.add_argument("--returns-directory", default="daily_returns/")
+    parser.add_argument("--dataset", default=None, help="write one partitioned parquet dataset here instead of csv files")
+    args = parser.parse_args()
+    backfill_returns(args.start, args.end, returns_directory=args.returns_directory, dataset_path=args.dataset)
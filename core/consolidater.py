@@ -1,32 +1,153 @@
 import os 
+import json
+import hashlib
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from core.nav_store import (NAV_STORE_PATH, INGESTED_COLUMN, replace_nav_store_tag, compact_nav_store,
+                            nav_store_exists, read_nav_store)
 
-def consolidater(directory_path = "historical_nav", output_nav_file_path= "nav_time_series.csv"):
+# store tag of the rows parsed from the text files; the rows other writers appended are never touched
+CONSOLIDATED_TAG = "consolidated"
+
+
+def parse_history_file(filepath):
+    """one AMC / scheme history text file -> cleaned NAV rows (vectorised, no per-row python)"""
+    df = pd.read_csv(filepath, delimiter=";", dtype=str)
+    # AMC-name / scheme-category lines have no numeric scheme code
+    codes = pd.to_numeric(df["Scheme Code"], errors="coerce")
+    keep = (codes.notna() & (codes >= 0) & (codes % 1 == 0)).to_numpy()
+    df = df[keep].copy()
+    df["Scheme Code"] = codes[keep].astype(np.int64)
+
+    df["Net Asset Value"] = pd.to_numeric(df["Net Asset Value"], errors="coerce")   # "N.A." -> NaN
+    df["Date"] = _iso_dates(df["Date"])
+    df = df.dropna(subset=['Date', "Net Asset Value"])
+    df = df[df["Net Asset Value"] != 0]
+
+    return df.drop(["Sale Price", "Repurchase Price"], axis=1, errors="ignore")
+
+
+def _iso_dates(dates):
+    """"17-Oct-2025" style strings -> "2025-10-17"; every distinct date string is parsed only once"""
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce", format="%d-%b-%Y")
+    unparsed = parsed.isna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(pd.Series(uniques[unparsed.to_numpy()], dtype=object), errors="coerce", format="mixed").to_numpy()
+    iso = parsed.dt.strftime('%Y-%m-%d').to_numpy(dtype=object)
+    return pd.Series(np.where(codes >= 0, iso[codes], None), index=dates.index)
+
+
+def _parse_safely(filepath):
+    try:
+        return parse_history_file(filepath), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _file_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_manifest(cache_path):
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _save_manifest(cache_path, manifest):
+    tmp_path = os.path.join(cache_path, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(cache_path, "manifest.json"))
+
+
+def consolidater(directory_path = "historical_nav", output_nav_file_path= None, nav_store_path = NAV_STORE_PATH, workers = None, incremental = True):
+    """parses every AMC text file in `directory_path` and replaces the NAV store's consolidated rows with the result.
+        rows appended by the daily run or downloaded straight into the store (other tags) are kept; a
+        (code, date) pair held by both keeps the later of the text file's mtime and the other row's ingest time.
+        files are parsed by `workers` processes (default: one per core, 1 = serial) and concatenated once.
+        with `incremental` each file's parsed rows are cached under `<directory_path>/.parsed/` next to a manifest
+        of (size, mtime, sha256); only new or changed files are re-parsed and deleted files drop out.
+        `output_nav_file_path` optionally exports the consolidated rows as a semicolon CSV as well."""
     text_files = list(filter( lambda x : x.endswith(".txt") , os.listdir(directory_path)))
+    workers = workers or os.cpu_count() or 1
+    cache_path = os.path.join(directory_path, ".parsed")
+    manifest = _load_manifest(cache_path) if incremental else {}
 
-    total_df = pd.DataFrame()
+    # fingerprint: size + mtime decide quickly, the content hash settles touched-but-identical files
+    to_parse, reused = [], {}
     for file in text_files:
-        try:
-            filepath= os.path.join(directory_path , file)
-            if(not os.path.exists(filepath)): continue
-            print(file)
-            df = pd.read_csv(filepath ,delimiter=";" )
-            df = df[df["Scheme Code"].fillna("-").astype(str).apply(lambda x : x.isdigit())]
-
-            df["Scheme Code"] = df["Scheme Code"].astype(int)
-            df["Net Asset Value"] =df["Net Asset Value"].replace("N.A." ,np.nan)
-            df["Date"] = pd.to_datetime(df['Date'], errors = "coerce").dt.strftime('%Y-%m-%d')
-            df.dropna(subset=['Date',"Net Asset Value"], inplace=True)
-            df["Net Asset Value"] =df["Net Asset Value"].astype(np.float64)
-            df = df[df["Net Asset Value"]!=0]
-            
-
-            df = df.drop(["Sale Price" , "Repurchase Price"] , axis = 1)
-            total_df = pd.concat([total_df, df])
-        except Exception as e:
-            print(f"Skipping {file} as {str(e)}")
-    total_df.to_csv(output_nav_file_path, index=False, sep=";")
+        filepath = os.path.join(directory_path, file)
+        stat = os.stat(filepath)
+        entry = manifest.get(file)
+        if entry and not os.path.exists(os.path.join(cache_path, entry["partition"])):
+            entry = None
+        if entry and (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime):
+            reused[file] = entry
+            continue
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime,
+                       "sha256": _file_hash(filepath) if incremental else None}
+        if entry and entry["sha256"] == fingerprint["sha256"]:
+            reused[file] = {**entry, **fingerprint}
+        else:
+            to_parse.append((file, fingerprint))
+
+    filepaths = [os.path.join(directory_path, file) for file, _ in to_parse]
+    if workers > 1 and len(filepaths) > 1:
+        chunksize = max(1, len(filepaths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_parse_safely, filepaths, chunksize=chunksize))
+    else:
+        results = list(map(_parse_safely, filepaths))
+    parsed = {file: (fingerprint, result) for (file, fingerprint), result in zip(to_parse, results)}
+
+    if incremental:
+        os.makedirs(cache_path, exist_ok=True)
+    frames, mtimes, new_manifest = [], [], {}
+    for file in text_files:
+        if file in reused:
+            frames.append(pd.read_parquet(os.path.join(cache_path, reused[file]["partition"])))
+            mtimes.append(reused[file]["mtime"])
+            new_manifest[file] = reused[file]
+            continue
+        fingerprint, (df, error) = parsed[file]
+        if error is not None:
+            print(f"Skipping {file} as {error}")
+            continue
+        print(file)
+        frames.append(df)
+        mtimes.append(fingerprint["mtime"])
+        if incremental:
+            partition = f"{fingerprint['sha256']}.parquet"
+            df.to_parquet(os.path.join(cache_path, partition))
+            new_manifest[file] = {**fingerprint, "partition": partition, "rows": len(df)}
+    total_df = pd.concat(frames) if frames else pd.DataFrame()
+    print(f"consolidated {len(text_files)} files: {len(to_parse)} parsed, {len(reused)} from cache, "
+          f"{len(set(manifest) - set(text_files))} dropped")
+
+    if incremental:
+        # partitions of deleted / replaced files
+        live = {entry["partition"] for entry in new_manifest.values()}
+        for entry in manifest.values():
+            if entry["partition"] not in live and os.path.exists(os.path.join(cache_path, entry["partition"])):
+                os.remove(os.path.join(cache_path, entry["partition"]))
+        _save_manifest(cache_path, new_manifest)
+
+    if new_manifest != manifest or not incremental or not nav_store_exists(nav_store_path):
+        ingested = pd.to_datetime(np.repeat(mtimes, [len(frame) for frame in frames]), unit="s")
+        replace_nav_store_tag(total_df.assign(**{INGESTED_COLUMN: ingested}), nav_store_path, tag=CONSOLIDATED_TAG)
+        if read_nav_store(nav_store_path, columns=["Scheme Code", "Date"]).duplicated().any():
+            compact_nav_store(nav_store_path)
+    if output_nav_file_path:
+        total_df.to_csv(output_nav_file_path, index=False, sep=";")
 
     return total_df
 
@@ -34,5 +155,5 @@ if __name__ == "__main__":
     
     directory_path =  "Historical_nav/"
     output_nav_file_path = "Historical_nav/nav_time_series_PPFAS.csv"
-    total_df = consolidater(directory_path , output_nav_file_path)
+    total_df = consolidater(directory_path , output_nav_file_path, nav_store_path="Historical_nav/nav_store_PPFAS")
     print(total_df.iloc[:100])
\ No newline at end of file
@@ -9,6 +9,10 @@ import warnings
 from core.update_latest_nav import update_latest_nav
 from core.calculator import calculate_returns
 from core.downloader import download_amfi_nav
+from core.nav_store import NAV_STORE_PATH, nav_store_exists, read_nav_store, import_nav_csv
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix, load_or_build
+from core.log_index import update_log_index
+from core.scheme_registry import SCHEME_REGISTRY_PATH, SchemeRegistry
 warnings.simplefilter("ignore",pd.errors.DtypeWarning)
 
 
@@ -24,24 +28,36 @@ def task(   historical_nav_directory = "historical_nav/",
     directory_check(returns_directory)
     
     nav_file_path = "nav_time_series.csv"
+    nav_store_path = NAV_STORE_PATH
+    nav_matrix_path = NAV_MATRIX_PATH
     date = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
 
     output_returns_file_path= os.path.join(returns_directory , f"returns_as_on {date}.csv")
     
 
-    daily_nav_file = download_amfi_nav()
+    daily_nav_file, changed = download_amfi_nav()
+    if not changed and os.path.exists(output_returns_file_path):
+        print(f"NAVAll unchanged and {output_returns_file_path} exists, nothing to update")
+        return True
     #%%
-    historical_df = pd.DataFrame()
-    if os.path.exists(nav_file_path):
-        historical_df = pd.read_csv(nav_file_path,delimiter=";").dropna(subset=["Scheme Code"])     
+    if not nav_store_exists(nav_store_path) and os.path.exists(nav_file_path):
+        import_nav_csv(nav_file_path, nav_store_path)   # one-off migration from the old csv
+    # the full history is only read when the persisted matrix is missing
+    nav_matrix = load_or_build(lambda: read_nav_store(nav_store_path), nav_matrix_path)
 
     #%%
-    updated_df = update_latest_nav(historical_df=historical_df,
-                                historical_nav_file_path = nav_file_path,
+    new_df = update_latest_nav(historical_df=pd.DataFrame(),
+                                nav_store_path = nav_store_path,
                                 daily_nav_file_path= daily_nav_file)
+    SchemeRegistry.load(SCHEME_REGISTRY_PATH).update(SchemeRegistry.from_navall(new_df)).save(SCHEME_REGISTRY_PATH)
+    rebuilt = not nav_matrix.append(new_df, path=nav_matrix_path)
+    if rebuilt:
+        nav_matrix = NavMatrix.from_history(read_nav_store(nav_store_path))
+        nav_matrix.save(nav_matrix_path)
+    update_log_index(nav_matrix, nav_matrix_path, rebuild=rebuilt)   # sums only the new rows after an append
 
     #%%
-    returns_df = calculate_returns(df=updated_df,
+    returns_df = calculate_returns(nav_matrix=nav_matrix,
                                 return_file_path=output_returns_file_path)
     
     return True
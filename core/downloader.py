@@ -1,28 +1,89 @@
 import requests
+from core.http_client import default_client
 from datetime import datetime
 import os
+import gzip
+import json
+import shutil
+import hashlib
 import pandas as pd
 
+AMFI_NAVALL_URL = "https://www.amfiindia.com/spages/NAVAll.txt"
 
-def download_amfi_nav(output_dir="daily_nav"):
+
+def _load_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def _save_state(state_path, state):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, state_path)
+
+
+def _archive_as(source, file_path):
+    """dated copy of an unchanged download (a hard link where the filesystem allows it)"""
+    if os.path.abspath(source) == os.path.abspath(file_path) or os.path.exists(file_path):
+        return
+    try:
+        os.link(source, file_path)
+    except OSError:
+        shutil.copyfile(source, file_path)
+
+
+def download_amfi_nav(output_dir="daily_nav", amfi_url=AMFI_NAVALL_URL):
+    """downloads NAVAll.txt into `output_dir/NAVAll_<date>.txt.gz` -> (file_path, changed).
+        the ETag / Last-Modified / sha256 of the last download are kept in `output_dir/navall_state.json`;
+        the request is conditional on them and an unchanged NAVAll (304, or same content) is not rewritten,
+        only archived under the new date with `changed=False` so callers can skip the downstream stages."""
     DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
 
-    # AMFI daily NAV data URL
-    amfi_url = "https://www.amfiindia.com/spages/NAVAll.txt"
     # Create output directory if not exists
     os.makedirs(output_dir, exist_ok=True)
     # Create a timestamped filename
     today = pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
-    file_path = os.path.join(output_dir, f"NAVAll_{today}.txt")
+    file_path = os.path.join(output_dir, f"NAVAll_{today}.txt.gz")
+    state_path = os.path.join(output_dir, "navall_state.json")
+    state = _load_state(state_path)
+    previous = state.get("file_path")
+    if not previous or not os.path.exists(previous):
+        state, previous = {}, None
+
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
     try:
         print(f"Downloading NAV data for {today}...")
-        response = requests.get(amfi_url, timeout=30)
+        response = default_client().get(amfi_url, headers=headers, timeout=30)
+        default_client().print_stats("NAVAll")
+        if response.status_code == 304:
+            print(f"NAVAll not modified since {state.get('last_modified') or state.get('etag')}")
+            _archive_as(previous, file_path)
+            return file_path, False
         response.raise_for_status()
-        with open(file_path, "w", encoding="utf-8") as f:
+
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        state.update(etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        if previous and sha256 == state.get("sha256"):
+            print("NAVAll content unchanged since the last download")
+            _archive_as(previous, file_path)
+            _save_state(state_path, state)
+            return file_path, False
+
+        tmp_path = file_path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
             f.write(response.text)
+        os.replace(tmp_path, file_path)
+        _save_state(state_path, {**state, "sha256": sha256, "file_path": file_path})
         print(f"NAV data saved to {file_path}")
     except requests.exceptions.RequestException as e:
         print(f"Failed to download AMFI NAV data: {e}")
-    return file_path
+    return file_path, True
 if __name__ == "__main__":
     download_amfi_nav()
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+import pandas as pd
+
+
+class FetchJournal:
+    """durable record of completed nav-history windows, keyed by (amfi code, from date, to date), with the raw
+        response body (zlib-compressed) of each. a restarted backfill reads finished windows back from here and
+        only requests the missing ones. one sqlite file, safe to share between the downloader's threads"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS windows (
+                                amfi_code TEXT NOT NULL,
+                                from_date TEXT NOT NULL,
+                                to_date TEXT NOT NULL,
+                                payload BLOB NOT NULL,
+                                fetched_at REAL NOT NULL,
+                                PRIMARY KEY (amfi_code, from_date, to_date))""")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # first NAV date of schemes whose range before their first stored NAV came back empty (pre-inception)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS first_navs (amfi_code TEXT PRIMARY KEY, first_date TEXT NOT NULL)")
+        self.conn.commit()
+
+    @staticmethod
+    def _key(amfi_code, from_date, to_date):
+        return str(amfi_code), pd.Timestamp(from_date).strftime("%Y-%m-%d"), pd.Timestamp(to_date).strftime("%Y-%m-%d")
+
+    def get(self, amfi_code, from_date, to_date):
+        """raw payload of a completed window, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT payload FROM windows WHERE amfi_code=? AND from_date=? AND to_date=?",
+                                    self._key(amfi_code, from_date, to_date)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def put(self, amfi_code, from_date, to_date, payload):
+        """mark a window complete; committed before returning so a crash right after keeps it"""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?)",
+                              (*self._key(amfi_code, from_date, to_date), zlib.compress(payload), time.time()))
+            self.conn.commit()
+
+    def completed(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM windows").fetchone()[0]
+
+    def first_navs(self):
+        """{amfi code: first NAV date} of the schemes known to have no NAVs before that date"""
+        with self.lock:
+            rows = self.conn.execute("SELECT amfi_code, first_date FROM first_navs").fetchall()
+        return {code: pd.Timestamp(date) for code, date in rows}
+
+    def set_first_navs(self, first_navs):
+        """record {amfi code: first NAV date}; the range before it is not asked for again"""
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO first_navs VALUES (?, ?)",
+                                  [(str(code), pd.Timestamp(date).strftime("%Y-%m-%d")) for code, date in first_navs.items()])
+            self.conn.commit()
+
+    def window_dates(self, name, dates):
+        """the window boundaries `dates` (newest first) of the backfill called `name`, pinned the first time they
+            are asked for, so a run resumed on a later day keeps requesting (and finding) the same windows.
+            when `dates` ends later than the pinned ones, a window from the pinned end to the new end is added"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key=?", (name,)).fetchone()
+            if row:
+                pinned = [pd.Timestamp(d) for d in json.loads(row[0])]
+                if pd.Timestamp(dates[0]).normalize() > pinned[0].normalize():
+                    pinned.insert(0, pd.Timestamp(dates[0]))
+                return pinned
+            self.conn.execute("INSERT INTO meta VALUES (?, ?)", (name, json.dumps([pd.Timestamp(d).isoformat() for d in dates])))
+            self.conn.commit()
+        return dates
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
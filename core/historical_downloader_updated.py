@@ -1,19 +1,108 @@
 import pandas as pd
-import requests
+import numpy as np
 import os
-import re
+import json
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.rate_limiter import HostRateLimiter
+from core.http_client import HttpClient
+from core.fetch_journal import FetchJournal
+from core.scheme_registry import SCHEME_REGISTRY_PATH, SchemeRegistry, split_isins
+from core.nav_store import NAV_STORE_PATH, read_nav_store, append_nav_store, compact_nav_store
+
+# schemes fetched concurrently (1 = serial) and requests per second allowed per host
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 8))
+DOWNLOAD_RATE = float(os.environ.get("DOWNLOAD_RATE", 4))
+AMFI_BASE_URL = "https://www.amfiindia.com"
+# longest range the nav-history API is asked for in one request (same as the `_get_dates` windows)
+WINDOW_DAYS = 365*5 - 7
+# rows buffered before each append when streaming into the NAV store
+INGEST_BATCH_ROWS = 500_000
+
+
+def missing_ranges(dates, start, end, max_gap_days=7, first_nav=None):
+    """(from, to) day ranges of [start, end] not covered by the sorted stored `dates` of one scheme:
+        the leading gap and interior gaps longer than `max_gap_days` (weekends / holidays are not gaps),
+        and anything after the last stored date that includes a weekday. ranges are split into API-sized `WINDOW_DAYS` chunks.
+        `first_nav` is the scheme's known first NAV date: the leading gap only reaches back to it"""
+    start, end = np.datetime64(start, "D"), np.datetime64(end, "D")
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    dates = dates[(dates >= start) & (dates <= end)]
+    lead = start if first_nav is None else max(start, np.datetime64(pd.Timestamp(first_nav).date(), "D"))
+    if len(dates) == 0:
+        ranges = [(lead, end)] if lead <= end else []
+    else:
+        max_gap = np.timedelta64(max_gap_days, "D")
+        one_day = np.timedelta64(1, "D")
+        ranges = [(lead, dates[0] - one_day)] if dates[0] - lead > max_gap else []
+        gaps = np.flatnonzero(np.diff(dates) > max_gap)
+        ranges += [(dates[i] + one_day, dates[i + 1] - one_day) for i in gaps]
+        if np.busday_count(dates[-1] + one_day, end + one_day) > 0:
+            ranges.append((dates[-1] + one_day, end))
+    window = np.timedelta64(WINDOW_DAYS, "D")
+    chunks = []
+    for low, high in ranges:
+        while low <= high:
+            chunks.append((pd.Timestamp(low), pd.Timestamp(min(high, low + window))))
+            low = low + window + np.timedelta64(1, "D")
+    return chunks
+
+
+def records_frame(records, code, name, isin_growth, isin_reinvest):
+    """nav-history `historical_records` -> typed long-format NAV rows, dropping missing / zero NAVs like the consolidater.
+        consecutive windows share their boundary date, so a date returned twice is kept once (the later window's)"""
+    raw_dates = [record.get("date") or "NaT" for record in records]
+    try:
+        dates = np.array(raw_dates, dtype="datetime64[D]")
+    except ValueError:
+        dates = pd.to_datetime(pd.Series(raw_dates), errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+    navs = pd.to_numeric(pd.Series([record.get("nav") for record in records], dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+    keep = ~np.isnat(dates) & ~np.isnan(navs) & (navs != 0)
+    last = np.zeros(len(dates), dtype=bool)
+    last[len(dates) - 1 - np.unique(dates[::-1], return_index=True)[1]] = True
+    keep &= last
+    return pd.DataFrame({
+        "Scheme Code": np.full(keep.sum(), int(code), dtype=np.int64),
+        "Scheme Name": name,
+        "ISIN Div Payout/ISIN Growth": isin_growth or None,
+        "ISIN Div Reinvestment": isin_reinvest or None,
+        "Net Asset Value": navs[keep],
+        "Date": dates[keep],
+    })
+
+
+@lru_cache(maxsize=None)
+def _format_date(date):
+    # every scheme repeats the same few thousand dates; parse each one once across all workers
+    return pd.Timestamp(date).strftime("%d-%b-%Y")
 
 
 class HistoricalNAVDownloader:
     def __init__(self, path_BSESchemeData = r"core\SchemeData090825.csv",
                      path_output_folder = "historical_nav",
-                     years_back = 10):
+                     years_back = 10,
+                     workers = DOWNLOAD_WORKERS,
+                     rate_limit = DOWNLOAD_RATE,
+                     max_in_flight = None,
+                     base_url = AMFI_BASE_URL,
+                     journal = True,
+                     registry_path = SCHEME_REGISTRY_PATH,
+                     bse_code_col = "BSE Code"):
         
         # Handle exceptions
         # Assign class attributes
         self.path_BSESchemeData = path_BSESchemeData
-        self.path_output_folder= path_output_folder,
+        self.path_output_folder= path_output_folder
         self.years_back = years_back
+        self.workers = max(1, int(workers or 1))
+        # bounds the schemes whose responses are held in memory at once
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.rate_limiter = HostRateLimiter(rate_limit, burst=self.workers)
+        self.base_url = base_url.rstrip("/")
+        self.journal = None
+        # (code, from, to) windows that were answered without records, and {code: first NAV date} found from them
+        self.empty_windows = set()
+        self.first_navs = {}
 
         if(not os.path.exists(path_BSESchemeData)):
             print("Please provide a valid path for BSE Scheme Data sheet")
@@ -28,14 +117,27 @@ class HistoricalNAVDownloader:
             self.scheme_name_col = "Scheme NAV Name"
             self.payout_ISIN_col = "ISIN Div Payout/ ISIN Growth"
             self.reinvest_ISIN_col = "ISIN Div Reinvestment"
-            self.BSESchemeData = self.BSESchemeData[["Code", "Scheme NAV Name","ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment"]].astype(str)
+            # the sheet's BSE code column, when it has one, is kept for the registry's BSE code lookups
+            self.bse_code_col = bse_code_col if bse_code_col in self.BSESchemeData else None
+            self.BSESchemeData = self.BSESchemeData[["Code", "Scheme NAV Name","ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment"]
+                                                    + ([self.bse_code_col] if self.bse_code_col else [])].astype(str)
             # Segeragate / Refine ISIN Columns 
-            for idx , row in self.BSESchemeData.iterrows():
-                matches = self._get_isin(row["ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment"])
-                self.BSESchemeData.at[idx, self.payout_ISIN_col] = matches[0]
-                self.BSESchemeData.at[idx, self.reinvest_ISIN_col] = matches[1]
-    
+            growth, reinvest = split_isins(self.BSESchemeData["ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment"])
+            self.BSESchemeData[self.payout_ISIN_col] = growth
+            self.BSESchemeData[self.reinvest_ISIN_col] = reinvest
+            # code / ISIN lookups; the sheet only fills what the persisted registry (NAVAll) does not know yet
+            self.registry = SchemeRegistry.from_bse_sheet(self.BSESchemeData, bse_col=self.bse_code_col)
+            if registry_path is not None:
+                self.registry.update(SchemeRegistry.load(registry_path)).save(registry_path)
+            self.codes = pd.to_numeric(self.BSESchemeData[self.amfi_code_col], errors="coerce")
+
             self.dates = self._get_dates()
+            # completed windows survive a crash in `<output>/.fetch_journal.sqlite` (or the given path);
+            # delete the journal to start a fresh backfill
+            if journal:
+                journal_path = journal if isinstance(journal, str) else os.path.join(path_output_folder, ".fetch_journal.sqlite")
+                self.journal = FetchJournal(journal_path)
+                self.dates = self.journal.window_dates(f"years_back={years_back}", self.dates)
 
         except Exception as e:
             print(f"Error Initialising HistoricalNAVDownloader {str(e)}")
@@ -58,94 +160,199 @@ class HistoricalNAVDownloader:
             "Sec-Fetch-Site": "none",
             "Sec-Fetch-User": "?1"
         }
+        # one keep-alive connection per worker, retries go through the same rate limiter
+        self.client = HttpClient(headers=self.headers, pool_size=self.workers, rate_limiter=self.rate_limiter)
 
     
 
     # -- main methods --
-    def get_all_from_scheme_data(self):
-        self._fetch_store(self.BSESchemeData)
-
-    def get_nav_history(self, list_amfi_codes = [], list_ISINs = []):
-        list_amfi_codes = list(map(str, list_amfi_codes))
-
-        def process_row(row):
-            code = row[self.amfi_code_col]
-            payout = row[self.payout_ISIN_col]
-            reinvest = row[self.reinvest_ISIN_col]
-
-            if(code in list_amfi_codes or
-                payout in list_ISINs or
-                reinvest in list_ISINs):
-                return True
-
-            return False
-        
-        self.filtered_indices = self.BSESchemeData[self.BSESchemeData.apply(process_row, axis = 1)]
-        self._fetch_store(self.filtered_indices)
+    def get_all_from_scheme_data(self, store_path = None):
+        """every scheme of the BSE sheet; with `store_path` straight into that NAV store instead of text files"""
+        return self._fetch_store(self.BSESchemeData, store_path=store_path)
+
+    def get_nav_history(self, list_amfi_codes = [], list_ISINs = [], store_path = None):
+        codes = self.registry.codes(amfi_codes=list_amfi_codes, isins=list_ISINs)
+        self.filtered_indices = self.BSESchemeData[self.codes.isin(codes).to_numpy()]
+        return self._fetch_store(self.filtered_indices, store_path=store_path)
+
+    def sync_from_store(self, nav_store_path = NAV_STORE_PATH, list_amfi_codes = None, max_gap_days = 7):
+        """fetch only what the NAV store is missing for each scheme over the `years_back` range up to today
+            (see `missing_ranges`), streamed straight into the store. returns the number of rows added"""
+        codes = self.codes if list_amfi_codes is None else self.codes.where(self.codes.isin(self.registry.codes(amfi_codes=list_amfi_codes)))
+        df = self.BSESchemeData[codes.notna().to_numpy()]
+        codes = codes.dropna()
+        start, end = self.dates[-1].normalize(), pd.Timestamp.today().normalize()
+
+        stored = read_nav_store(nav_store_path, columns=["Scheme Code", "Date"], start=start,
+                                scheme_codes=codes.dropna().astype(np.int64).unique())
+        coverage = {code: np.unique(dates.to_numpy().astype("datetime64[D]"))
+                    for code, dates in stored.groupby("Scheme Code")["Date"]}
+        empty = np.array([], dtype="datetime64[D]")
+        # schemes whose pre-inception range already came back empty are not asked for it again
+        first_navs = self.journal.first_navs() if self.journal is not None else self.first_navs
+        windows = {code: missing_ranges(coverage.get(int(code), empty), start, end, max_gap_days, first_navs.get(str(code)))
+                   for code in df[self.amfi_code_col]}
+        windows = {code: w for code, w in windows.items() if w}
+        print(f"{len(windows)} of {len(df)} schemes have gaps | {sum(map(len, windows.values()))} windows to fetch")
+
+        stored = self._fetch_store(df[df[self.amfi_code_col].isin(list(windows))], windows=windows,
+                                   store_path=nav_store_path)
+        # a leading gap whose windows all answered without records lies before the scheme's first NAV
+        inceptions = {}
+        for code, ranges in windows.items():
+            first = coverage.get(int(code))
+            if first is None or len(first) == 0:
+                continue
+            leading = [(str(code), low, high) for low, high in ranges if high < pd.Timestamp(first[0])]
+            if leading and all(window in self.empty_windows for window in leading):
+                inceptions[str(code)] = pd.Timestamp(first[0])
+        if inceptions:
+            print(f"{len(inceptions)} schemes have no NAVs before their first stored one")
+            self.first_navs.update(inceptions)
+            if self.journal is not None:
+                self.journal.set_first_navs(inceptions)
+        return stored
+
+
+    def _fetch_store(self, df:pd.DataFrame, windows = None, store_path = None):
+        """fetch every scheme of `df`; `windows` optionally maps a code to the (from, to) ranges to request
+            instead of the full `years_back` span. schemes are written as text files (returns the files), or with
+            `store_path` streamed straight into the NAV store (returns the rows stored, see `_ingest`)"""
+        if self.journal is not None:
+            print(f"{self.journal.completed()} windows already in {self.journal.path}")
+        task = self._scheme_frame if store_path else self._fetch_scheme
+        results = self._run(task, df, windows or {})
+        if store_path:
+            return self._ingest(results, store_path)
+        return [file for file in results if file]
+
+    def _run(self, task, df, windows):
+        """yields `task(row, windows)` for every scheme as it completes; no more than `max_in_flight`
+            schemes are queued or being fetched at any time"""
+        rows = (row for _, row in df.iterrows())
+        if self.workers == 1:
+            for row in rows:
+                yield task(row, windows.get(row[self.amfi_code_col]))
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = set()
+                for row in rows:
+                    if len(pending) >= self.max_in_flight:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        yield from (future.result() for future in done)
+                    pending.add(executor.submit(task, row, windows.get(row[self.amfi_code_col])))
+                yield from (future.result() for future in wait(pending).done)
+        self.client.print_stats("nav-history")
+
+    def _ingest(self, frames, store_path, batch_rows = INGEST_BATCH_ROWS):
+        """append scheme frames to the NAV store in batches of ~`batch_rows` rows (one writer: the caller's thread).
+            (code, date) pairs fetched again replace the copies the store already held"""
+        prefix = f"history-{pd.Timestamp.now().strftime('%Y%m%d%H%M%S')}"
+        buffer, buffered, stored, codes = [], 0, 0, set()
+        for frame in frames:
+            if frame is None or frame.empty:
+                continue
+            buffer.append(frame)
+            buffered += len(frame)
+            codes.add(int(frame["Scheme Code"].iat[0]))
+            if buffered >= batch_rows:
+                stored += append_nav_store(pd.concat(buffer), store_path, tag=f"{prefix}-{stored}")
+                buffer, buffered = [], 0
+        if buffer:
+            stored += append_nav_store(pd.concat(buffer), store_path, tag=f"{prefix}-{stored}")
+        if codes:
+            keys = read_nav_store(store_path, columns=["Scheme Code", "Date"], scheme_codes=codes)
+            if keys.duplicated().any():
+                compact_nav_store(store_path)
+        print(f"{stored} rows of {len(codes)} schemes stored in {store_path}")
+        return stored
+
+    def _scheme_info(self, row):
+        return (row.get(self.amfi_code_col,""), row.get(self.scheme_name_col,""),
+                row.get(self.payout_ISIN_col,""), row.get(self.reinvest_ISIN_col,""))
+
+    def _scheme_frame(self, row, windows = None):
+        """one scheme's records as a typed long-format frame (the rows `parse_history_file` would give for its text file)"""
+        code, name, paygrow, reinvest = self._scheme_info(row)
+        try:
+            frame = records_frame(self._get_data_points(code, windows or self._windows()), code, name, paygrow, reinvest)
+            print(f"Fetched {name} - AMFI code: {code} | {len(frame)} NAVs")
+            return frame
+        except Exception as e:
+            print(f"Error {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest}\n{str(e)} - {e.__traceback__.tb_lineno}")
 
+    def _fetch_scheme(self, row, windows = None):
+        try:
+            code, name, paygrow, reinvest = self._scheme_info(row)
+            sale_price=""
+            header = "Scheme Code;Scheme Name;ISIN Div Payout/ISIN Growth;ISIN Div Reinvestment;Net Asset Value;Repurchase Price;Sale Price;Date"
+            lines = [header, ""]
+            windows = windows or self._windows()
+            span = f"from {windows[0][0].strftime("%d-%b-%Y")} to {windows[-1][1].strftime("%d-%b-%Y")}"
+
+            data_points = self._get_data_points(code, windows)
+            
+            if len(data_points) == 0:
+                print(f"Skipped {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest} \nNo data available {span}")
+                return
+
+            filter  = lambda x: "" if not x or pd.isna(x) else str(x)
+            for record in data_points:
+                date = _format_date(record.get("date",""))
+                nav = record.get("nav","")
+                repurchase = record.get("repurchase","")
+                new_record = [code, name, paygrow, reinvest, nav, repurchase, sale_price, date]
+                lines.append(";".join(map(filter, new_record)))
+            filename = f"{name}.txt"
+            filepath = os.path.join(self.path_output_folder, filename)
+
+            with open(filepath + ".tmp", "w") as f:
+                f.write("\n".join(lines))
+            os.replace(filepath + ".tmp", filepath)
+            print(f"Processed {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest} \n{span}")
+            return filepath
+        except Exception as e:
+            print(f"Error {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest}\n{str(e)} - {e.__traceback__.tb_lineno}")
 
-    def _fetch_store(self, df:pd.DataFrame):
-        for idx,row in df.iterrows():
-            try:
-                code = row.get(self.amfi_code_col,"")
-                name = row.get(self.scheme_name_col,"")
-                paygrow = row.get(self.payout_ISIN_col,"")
-                reinvest = row.get(self.reinvest_ISIN_col,"")
-                sale_price=""
-                header = "Scheme Code;Scheme Name;ISIN Div Payout/ISIN Growth;ISIN Div Reinvestment;Net Asset Value;Repurchase Price;Sale Price;Date"
-                text = ""
-                
-                data_points = self._get_data_points(code)
-                
-                if len(data_points) == 0:
-                    print(f"Skipped {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest} \nNo data available from {self.dates[-1].strftime("%d-%b-%Y")} to {self.dates[0].strftime("%d-%b-%Y")}")
-                    continue 
-
-                for record in data_points:
-                    date = record.get("date","")
-                    date = pd.Timestamp(date).strftime("%d-%b-%Y")
-                    nav = record.get("nav","")
-                    repurchase = record.get("repurchase","")
-                    new_record = [code, name, paygrow, reinvest, nav, repurchase, sale_price, date]
-                    filter  = lambda x: "" if not x or pd.isna(x) else str(x)
-                    new_record = list(map(filter, new_record))
-                    new_line = ";".join(new_record)
-                    text+= "\n" + new_line
-                filename = f"{name}.txt"
-                if(isinstance(self.path_output_folder,tuple)):
-                    self.path_output_folder = self.path_output_folder[0]
-                filepath = os.path.join(self.path_output_folder, filename)
-
-                text = header + "\n" + text
-                with open(filepath, "w") as f:
-                    f.write(text) 
-                print(f"Processed {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest} \nfrom {self.dates[-1].strftime("%d-%b-%Y")} to {self.dates[0].strftime("%d-%b-%Y")}")
-            except Exception as e:
-                print(f"Error {name} - AMFI code: {code} | payout/grow ISIN: {paygrow} | reinvest ISIN: {reinvest}\n{str(e)} - {e.__traceback__.tb_lineno}")
+    def _windows(self):
+        """consecutive (from, to) pairs of `self.dates`, oldest first"""
+        dates = self.dates[::-1]
+        return list(zip(dates[:-1], dates[1:]))
 
-    def _get_data_points(self, amfi_code):
+    def _get_data_points(self, amfi_code, windows = None):
         data_points = []
-        from_date = self.dates[-1]
 
-        for to_date in self.dates[::-1][1:] :
+        for from_date, to_date in windows or self._windows():
             url = self._build_url(from_Date= from_date, to_Date= to_date, amfi_code=amfi_code)
-            resp = requests.get(url, headers=self.headers, timeout=30)
-
-            if not resp.ok:
-                print(f"No response [{resp.status_code}]\n{url}")
-                from_date = to_date
-                continue
-            data = resp.json()
+            payload = self.journal.get(amfi_code, from_date, to_date) if self.journal is not None else None
+            if payload is None:
+                resp = self.client.get(url)
+
+                if not resp.ok:
+                    print(f"No response [{resp.status_code}]\n{url}")
+                    continue
+                payload = resp.content
+                fetched = True
+            else:
+                fetched = False
 
             try:
+                data = json.loads(payload)
                 points = data["data"]["nav_groups"][0]["historical_records"]
+                if not points:
+                    self.empty_windows.add((str(amfi_code), from_date, to_date))
                 data_points.extend(points)
                 print(len(data_points))
+                # only a window that parsed is journalled; a malformed response is requested again next run
+                if fetched and self.journal is not None:
+                    self.journal.put(amfi_code, from_date, to_date, payload)
 
             except Exception as e:
+                if isinstance(e, (KeyError, IndexError, TypeError)):
+                    # valid json without nav groups: AMFI's answer for a range with no NAVs
+                    self.empty_windows.add((str(amfi_code), from_date, to_date))
                 print(f"Error Fetching data Code: {amfi_code} \nfrom {from_date.strftime("%d-%b-%Y")} to {to_date.strftime("%d-%b-%Y")}\n{url}\n{str(e)}")
 
-            from_date = to_date
         return data_points
 
 
@@ -153,7 +360,7 @@ class HistoricalNAVDownloader:
     # -- util methods --    
     # Generate URL for json Data of provided Scheme on the given time period
     def _build_url(self,from_Date:pd.Timestamp ,to_Date:pd.Timestamp ,amfi_code):
-        return f"https://www.amfiindia.com/api/nav-history?query_type=historical_period&from_date={from_Date.strftime("%Y-%m-%d")}&to_date={to_Date.strftime("%Y-%m-%d")}&sd_id={amfi_code}"
+        return f"{self.base_url}/api/nav-history?query_type=historical_period&from_date={from_Date.strftime("%Y-%m-%d")}&to_date={to_Date.strftime("%Y-%m-%d")}&sd_id={amfi_code}"
 
     def _get_dates(self):
         """
@@ -169,16 +376,6 @@ class HistoricalNAVDownloader:
             dates.append(dates[-1] - pd.Timedelta(days= 365*yrs))
         return dates
 
-    def _get_isin(self,string):
-        if not isinstance(string, str):
-            return [None, None]
-        isin_pattern = "[A-Z]{3}[0-9A-Z]{9}"
-        matches =  re.findall(isin_pattern, string)
-        if(len(matches)) == 0: return [None, None]
-        if(len(matches) == 1): matches.append(None)
-        return matches
-
-
     # --- last function  ---
     def _read_excel(self, file_path):
         file_ext = str(file_path).lower()
@@ -206,6 +403,15 @@ class HistoricalNAVDownloader:
     
 
 if __name__ == "__main__":
+    import sys
+    if "--sync" in sys.argv:
+        # only what the NAV store is missing, e.g. after an outage
+        HistoricalNAVDownloader().sync_from_store()
+        sys.exit()
+    if "--ingest" in sys.argv:
+        # full backfill straight into the NAV store, no text files
+        HistoricalNAVDownloader().get_all_from_scheme_data(store_path=NAV_STORE_PATH)
+        sys.exit()
     downloader = HistoricalNAVDownloader(path_output_folder="historical_nav_test")
     print(downloader.dates)
     downloader.get_nav_history(list_amfi_codes=["100119"], list_ISINs=["INF209K011W7"])
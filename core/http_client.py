@@ -0,0 +1,129 @@
+import os
+import random
+import threading
+import time
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from core.response_cache import ResponseCache
+
+# attempts after the first one, and the base / cap (seconds) of the exponential backoff between them
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.5))
+HTTP_MAX_BACKOFF = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """one pooled keep-alive `requests.Session` shared by every caller / thread.
+        transient failures (connection errors, timeouts, `RETRY_STATUSES`) are retried `retries` times with
+        exponential backoff and full jitter (a `Retry-After` header wins); the last response is returned as
+        `requests.get` would, the last exception is raised. every request is timed into `stats()`.
+        GETs go through `cache` (default: `HTTP_CACHE` / `HTTP_CACHE_PATH` env), which records responses or replays
+        them without touching the network"""
+    def __init__(self, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, max_backoff=HTTP_MAX_BACKOFF,
+                 timeout=30, pool_size=16, headers=None, rate_limiter=None, cache=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.cache = cache or ResponseCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # requests only decodes gzip/deflate without optional packages, so never advertise br/zstd
+        self.session.headers.update(headers or {})
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.lock = threading.Lock()
+        self.timings = []
+        self.failures = 0
+        self.retried = 0
+        self.replayed = 0
+        self.bytes = 0
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if method == "GET" and self.cache.mode == "replay":
+            response = self.cache.replay(url)
+            with self.lock:
+                self.replayed += 1
+            return response
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(time.perf_counter() - start, 0, failed=True, retry=attempt < self.retries)
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying {url} after {type(e).__name__} ({attempt + 1}/{self.retries})")
+                time.sleep(self._delay(attempt))
+                continue
+            retry = response.status_code in RETRY_STATUSES and attempt < self.retries
+            # streamed bodies are left unread for the caller
+            received = 0 if kwargs.get("stream") else len(response.content)
+            self._record(time.perf_counter() - start, received, failed=not response.ok, retry=retry)
+            if not retry:
+                if method == "GET" and self.cache.mode == "record" and response.status_code == 200 and not kwargs.get("stream"):
+                    self.cache.store(url, response, time.perf_counter() - start)
+                return response
+            print(f"Retrying {url} after HTTP {response.status_code} ({attempt + 1}/{self.retries})")
+            time.sleep(self._delay(attempt, response.headers.get("Retry-After")))
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _record(self, seconds, received, failed, retry):
+        with self.lock:
+            self.timings.append(seconds)
+            self.failures += failed
+            self.retried += retry
+            self.bytes += received
+
+    def stats(self):
+        """request count, failed attempts, retries, bytes received and latency percentiles (seconds)"""
+        with self.lock:
+            timings = np.array(self.timings)
+            stats = {"requests": len(timings), "failures": self.failures, "retries": self.retried,
+                     "replayed": self.replayed, "bytes": self.bytes}
+        if len(timings):
+            stats.update(mean=timings.mean(), p50=np.percentile(timings, 50), p95=np.percentile(timings, 95),
+                         max=timings.max(), total=timings.sum())
+        return stats
+
+    def print_stats(self, label="http"):
+        stats = self.stats()
+        line = f"[{label}] {stats['requests']} requests | {stats['failures']} failed | {stats['retries']} retried | {stats['bytes'] / 1e6:.1f} MB"
+        if stats["replayed"]:
+            line += f" | {stats['replayed']} replayed from {self.cache.path}"
+        if stats["requests"]:
+            line += f" | mean {stats['mean']:.3f}s p50 {stats['p50']:.3f}s p95 {stats['p95']:.3f}s max {stats['max']:.3f}s"
+        print(line)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """process-wide client for the one-off fetchers (daily NAVAll, legacy scraper)"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
@@ -0,0 +1,178 @@
+#%%
+import os
+import time
+import numpy as np
+import pandas as pd
+from core.calculator import asof_rows
+from core.nav_matrix import NAV_MATRIX_PATH, _write_rows
+
+# Prefix sums of daily log returns (and of their squares) per scheme, kept next to the NAV matrix:
+#   nav_matrix/cum_log.npy           float64 [dates x schemes], sum of ln(nav[r] / nav[r-1]) over rows 1..r
+#   nav_matrix/cum_log_sq.npy        float64 [dates x schemes], the same sum of squares
+#   nav_matrix/log_index_dates.npy   dates / scheme codes the sums were built for
+#   nav_matrix/log_index_codes.npy
+# Rows before a scheme's first NAV add 0. For any window [a, b] the return is exp(C[b] - C[a]) - 1 and the
+# variance of its log returns follows from (C[b] - C[a], Q[b] - Q[a]) - two row lookups per scheme, so the
+# statistics of any number of windows come from one gather instead of a rescan of the window's rows.
+# Rows carried forward over holidays add zero returns; they barely move the annualised volatility, which is
+# sum of squares per year (the count of rows cancels out of variance x observations per year).
+
+LOG_INDEX_BLOCK = int(os.environ.get("LOG_INDEX_BLOCK", 2048))   # schemes per block when building from scratch
+
+
+def log_returns(navs, previous=None):
+    """[rows x schemes] log return of each row over the one before (`previous` before the first); 0 where undefined"""
+    prior = np.vstack([navs[:1] if previous is None else previous[None], navs[:-1]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.log(navs / prior)
+    returns[~np.isfinite(returns)] = 0
+    return returns
+
+
+class LogReturnIndex:
+    def __init__(self, cum_log, cum_log_sq, dates, scheme_codes, first_rows):
+        self.cum_log = cum_log
+        self.cum_log_sq = cum_log_sq
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.scheme_codes = np.asarray(scheme_codes, dtype=np.int64)
+        self.first_rows = np.asarray(first_rows, dtype=np.int64)
+
+    @classmethod
+    def from_matrix(cls, nav_matrix, block=LOG_INDEX_BLOCK):
+        """prefix sums of the whole matrix, `block` schemes at a time"""
+        shape = (len(nav_matrix.dates), len(nav_matrix.scheme_codes))
+        cum_log, cum_log_sq = np.empty(shape), np.empty(shape)
+        for lo in range(0, shape[1], block):
+            returns = log_returns(np.asarray(nav_matrix.navs[:, lo:lo + block], dtype=np.float64))
+            np.cumsum(returns, axis=0, out=cum_log[:, lo:lo + block])
+            np.cumsum(returns * returns, axis=0, out=cum_log_sq[:, lo:lo + block])
+        return cls(cum_log, cum_log_sq, nav_matrix.dates, nav_matrix.scheme_codes, nav_matrix.first_rows)
+
+    # -- persistence --
+    @staticmethod
+    def exists(path=NAV_MATRIX_PATH):
+        return all(os.path.exists(os.path.join(path, f))
+                   for f in ("cum_log.npy", "cum_log_sq.npy", "log_index_dates.npy", "log_index_codes.npy"))
+
+    @classmethod
+    def load(cls, path=NAV_MATRIX_PATH, mmap_mode="r"):
+        """the sums are mapped like navs.npy; first rows come from the matrix saved in the same directory"""
+        return cls(np.load(os.path.join(path, "cum_log.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, "cum_log_sq.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, "log_index_dates.npy")),
+                   np.load(os.path.join(path, "log_index_codes.npy")),
+                   np.load(os.path.join(path, "first_rows.npy")))
+
+    def save(self, path=NAV_MATRIX_PATH):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "cum_log.npy"), np.ascontiguousarray(self.cum_log, dtype=np.float64))
+        np.save(os.path.join(path, "cum_log_sq.npy"), np.ascontiguousarray(self.cum_log_sq, dtype=np.float64))
+        self._save_index(path)
+
+    def _save_index(self, path):
+        np.save(os.path.join(path, "log_index_dates.npy"), self.dates)
+        np.save(os.path.join(path, "log_index_codes.npy"), self.scheme_codes)
+
+    # -- queries --
+    def stats(self, starts, ends):
+        """
+        return and CAGR (%) and annualised volatility (% of log returns) of every scheme over each window
+        [starts[i], ends[i]] -> {'return' | 'cagr' | 'volatility' | 'observations': [windows x schemes]}.
+        dates resolve to the last row on or before them, like `calculate_returns`; a scheme without a NAV
+        at a window's start is NaN for that window, and so is the volatility of a window with one return
+        """
+        starts = np.atleast_1d(np.asarray(pd.to_datetime(starts).values, dtype="datetime64[D]"))
+        ends = np.atleast_1d(np.asarray(pd.to_datetime(ends).values, dtype="datetime64[D]"))
+        start_rows, end_rows = asof_rows(self.dates, starts), asof_rows(self.dates, ends)
+        rows = np.concatenate([start_rows, end_rows])
+        gathered_log = np.asarray(self.cum_log[np.maximum(rows, 0)])
+        gathered_sq = np.asarray(self.cum_log_sq[np.maximum(rows, 0)])
+        n = len(starts)
+        sum_log = gathered_log[n:] - gathered_log[:n]
+        sum_sq = gathered_sq[n:] - gathered_sq[:n]
+        years = ((ends - starts).astype(np.int64) / 365)[:, None]
+        observations = (end_rows[:, None] - start_rows[:, None]).repeat(len(self.scheme_codes), axis=1)
+        valid = ((start_rows[:, None] >= self.first_rows[None, :]) & (self.first_rows[None, :] >= 0)
+                 & (start_rows[:, None] >= 0) & (observations > 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = (sum_sq - sum_log * sum_log / observations) / (observations - 1)
+            stats = {
+                'return': np.expm1(sum_log) * 100,
+                'cagr': np.expm1(sum_log / years) * 100,
+                'volatility': np.sqrt(np.maximum(variance, 0) * observations / years) * 100,
+            }
+        stats = {name: np.where(valid & np.isfinite(values), values, np.nan) for name, values in stats.items()}
+        # a single return has no sample variance (its 0 / 0 would otherwise be clipped to a volatility of 0)
+        stats['volatility'] = np.where(observations > 1, stats['volatility'], np.nan)
+        stats['observations'] = np.where(valid, observations, 0)
+        return stats
+
+    def between(self, start, end):
+        """return / CAGR / volatility (%) of every scheme between two dates -> frame indexed by Scheme Code"""
+        stats = self.stats([start], [end])
+        return pd.DataFrame({name: values[0] for name, values in stats.items()},
+                            index=pd.Index(self.scheme_codes, name='Scheme Code'))
+
+
+def update_log_index(nav_matrix, path=NAV_MATRIX_PATH, rebuild=False):
+    """
+    bring the persisted index in line with `nav_matrix` (saved at `path`) after `NavMatrix.append`: only the rows
+    from the index's last one on are summed (append may have replaced the last row) and appended in place;
+    new schemes add columns of zeros for the old rows (they had no NAVs yet), which rewrites the files.
+    a missing or mismatched index, or `rebuild` (after the matrix was rebuilt from history), builds it from scratch
+    """
+    started = time.perf_counter()
+    index = LogReturnIndex.load(path) if not rebuild and LogReturnIndex.exists(path) else None
+    if index is not None:
+        n, k = index.cum_log.shape
+        fits = (1 < n <= len(nav_matrix.dates) and k <= len(nav_matrix.scheme_codes)
+                and (index.dates[:n - 1] == nav_matrix.dates[:n - 1]).all()
+                and (index.scheme_codes == nav_matrix.scheme_codes[:k]).all())
+        if not fits:
+            print("log-return index does not match the NAV matrix; rebuilding")
+            index = None
+    if index is None:
+        index = LogReturnIndex.from_matrix(nav_matrix)
+        index.save(path)
+        print(f"log-return index built in {time.perf_counter() - started:.2f}s")
+        return index
+
+    # the last row of the index may have been replaced, so it is recomputed from the row before it
+    kept = n - 1
+    navs = np.asarray(nav_matrix.navs[kept - 1:], dtype=np.float64)
+    returns = log_returns(navs[1:], previous=navs[0])
+    width = len(nav_matrix.scheme_codes)
+    base_log = np.zeros(width)
+    base_sq = np.zeros(width)
+    base_log[:k] = index.cum_log[kept - 1]
+    base_sq[:k] = index.cum_log_sq[kept - 1]
+    rows_log = np.cumsum(np.vstack([base_log, returns]), axis=0)[1:]
+    rows_sq = np.cumsum(np.vstack([base_sq, returns * returns]), axis=0)[1:]
+
+    updated = LogReturnIndex(None, None, nav_matrix.dates, nav_matrix.scheme_codes, nav_matrix.first_rows)
+    index = None   # release the mapped files before they are written
+    if k == width and _write_rows(os.path.join(path, "cum_log.npy"), rows_log, kept) \
+            and _write_rows(os.path.join(path, "cum_log_sq.npy"), rows_sq, kept):
+        updated._save_index(path)
+    else:
+        # rows before `kept` are untouched on disk even when one of the in-place writes went through
+        pad = np.zeros((kept, width - k))
+        updated.cum_log, updated.cum_log_sq = (
+            np.vstack([np.hstack([np.load(os.path.join(path, name))[:kept], pad]), rows])
+            for name, rows in (("cum_log.npy", rows_log), ("cum_log_sq.npy", rows_sq)))
+        updated.save(path)
+    print(f"log-return index updated with {len(rows_log)} rows in {time.perf_counter() - started:.2f}s")
+    return LogReturnIndex.load(path)
+
+
+#%%
+if __name__ == "__main__":
+    # volatility screen: 1y / 3y return, CAGR and volatility of every scheme as of the matrix's last date
+    index = LogReturnIndex.load(NAV_MATRIX_PATH)
+    end = pd.Timestamp(index.dates[-1])
+    started = time.perf_counter()
+    stats = index.stats([end - pd.Timedelta(days=365), end - pd.Timedelta(days=3 * 365)], [end, end])
+    print(f"{len(index.scheme_codes)} schemes x 2 windows in {time.perf_counter() - started:.4f}s")
+    print(pd.DataFrame({f"{name}_{window}": stats[name][i] for i, window in enumerate(["1y", "3y"])
+                        for name in ('cagr', 'volatility')},
+                       index=pd.Index(index.scheme_codes, name='Scheme Code')).describe().T)
@@ -7,37 +7,51 @@ from core.consolidater import consolidater
 from core.update_latest_nav import update_latest_nav
 from core.calculator import calculate_returns
 from core.downloader import download_amfi_nav
+from core.nav_store import NAV_STORE_PATH, read_nav_store
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix
+from core.log_index import update_log_index
+from core.scheme_registry import SCHEME_REGISTRY_PATH, SchemeRegistry
 warnings.simplefilter("ignore",pd.errors.DtypeWarning)
 directory_check = lambda directory: (os.mkdir(directory)) if not os.path.exists(directory) else f"{directory} exists"
 
-#%%
-
-DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
-
-historical_nav_directory = "historical_nav/"
-returns_directory = "daily_returns/"
-directory_check(historical_nav_directory)
-directory_check(returns_directory)
-
-output_nav_file_path= os.path.join("nav_time_series.csv")
-
-date=pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
-output_returns_file_path= os.path.join(returns_directory , f"returns_as_on {date}.csv")
-
-daily_nav_file = download_amfi_nav()
-#%%
-total_df = consolidater(directory_path=historical_nav_directory,
-                        output_nav_file_path=output_nav_file_path)
-total_df.to_csv("historical_nav.csv")
-#%%
-updated_df = update_latest_nav(historical_df=total_df,
-                               historical_nav_file_path = output_nav_file_path,
-                               daily_nav_file_path= daily_nav_file)
-updated_df.to_csv("upadated.csv")
-#%%
-returns_df = calculate_returns(df=updated_df,
-                               return_file_path=output_returns_file_path)
-
-
-
-# %%
+# processes used to parse historical_nav/*.txt (unset = one per core, 1 = serial)
+CONSOLIDATE_WORKERS = int(os.environ.get("CONSOLIDATE_WORKERS", 0)) or None
+
+def main():
+    DELTA_DAYS = int(os.environ.get("DELTA_DAYS",0))
+
+    historical_nav_directory = "historical_nav/"
+    returns_directory = "daily_returns/"
+    directory_check(historical_nav_directory)
+    directory_check(returns_directory)
+
+    nav_store_path = NAV_STORE_PATH
+
+    date=pd.Timestamp.today().date() - pd.Timedelta(days=DELTA_DAYS)
+    output_returns_file_path= os.path.join(returns_directory , f"returns_as_on {date}.csv")
+
+    daily_nav_file, _ = download_amfi_nav()
+    #%%
+    total_df = consolidater(directory_path=historical_nav_directory,
+                            nav_store_path=nav_store_path,
+                            workers=CONSOLIDATE_WORKERS)
+    total_df.to_csv("historical_nav.csv")
+    #%%
+    updated_df = update_latest_nav(historical_df=total_df,
+                                   nav_store_path = nav_store_path,
+                                   daily_nav_file_path= daily_nav_file)
+    updated_df.to_csv("upadated.csv")
+    SchemeRegistry.load(SCHEME_REGISTRY_PATH).update(SchemeRegistry.from_history(updated_df)).save(SCHEME_REGISTRY_PATH)
+    # from the store, so NAVs downloaded straight into it or appended on earlier days are included
+    nav_matrix = NavMatrix.from_history(read_nav_store(nav_store_path))
+    nav_matrix.save(NAV_MATRIX_PATH)
+    update_log_index(nav_matrix, NAV_MATRIX_PATH, rebuild=True)
+    #%%
+    returns_df = calculate_returns(nav_matrix=nav_matrix,
+                                   return_file_path=output_returns_file_path)
+    return returns_df
+
+
+# guarded so the consolidater's worker processes can re-import this module on spawn (Windows)
+if __name__ == "__main__":
+    main()
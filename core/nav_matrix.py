@@ -0,0 +1,255 @@
+#%%
+import os
+import numpy as np
+import pandas as pd
+from core.scheme_registry import last_known
+
+# Forward-filled dates x schemes NAV matrix persisted between runs, so the daily run appends one row
+# instead of re-pivoting the full long-format history.
+#   nav_matrix/navs.npy          float64 [dates x schemes], forward filled
+#   nav_matrix/dates.npy         datetime64[D] row index (sorted)
+#   nav_matrix/scheme_codes.npy  int64 column index (new schemes are appended at the end)
+#   nav_matrix/first_rows.npy    row of each scheme's first NAV (-1 = none yet)
+#   nav_matrix/isins_growth.npy  ISIN Div Payout/ISIN Growth per column ("" = none)
+#   nav_matrix/isins_reinvest.npy ISIN Div Reinvestment per column
+#   nav_matrix/schemes.parquet   latest Scheme Name / ISINs per column
+# navs.npy is opened with np.memmap, so notebooks, analytics and worker processes read row/column slices
+# from one shared page-cached copy instead of each loading (or re-pivoting) the history.
+
+NAV_MATRIX_PATH = "nav_matrix"
+META_FIELDS = ['Scheme Name', 'ISIN Div Payout/ISIN Growth', 'ISIN Div Reinvestment']
+
+
+def parse_dates(dates):
+    """Date column (strings, dates or timestamps) -> datetime64 series; each distinct value is parsed once"""
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.normalize()
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format="mixed").dt.normalize().to_numpy()
+    return pd.Series(np.where(codes >= 0, parsed[codes], np.datetime64("NaT")), index=dates.index)
+
+
+def _daily_wide(df, dates):
+    grouped = (pd.DataFrame({'Date': dates, 'Scheme Code': df['Scheme Code'].astype(np.int64),
+                             'Net Asset Value': df['Net Asset Value'].astype(np.float64)})
+               .groupby(['Date', 'Scheme Code'])['Net Asset Value'].mean())
+    return grouped.unstack('Scheme Code').sort_index()
+
+
+def build_nav_wide(df, dates=None):
+    """long-format history -> (forward-filled dates x schemes NAV array, datetime64[D] dates, scheme codes)"""
+    if dates is None:
+        dates = parse_dates(df['Date'])
+    nav_wide = _daily_wide(df, dates).ffill()
+    return (nav_wide.to_numpy(dtype=np.float64),
+            nav_wide.index.to_numpy(dtype="datetime64[D]"),
+            nav_wide.columns.to_numpy(dtype=np.int64))
+
+
+def first_valid_rows(navs):
+    """row of the first NAV of each scheme (-1 when the scheme has none)"""
+    valid = ~np.isnan(navs)
+    if len(valid) == 0:
+        return np.full(valid.shape[1], -1, dtype=np.int64)
+    rows = valid.argmax(axis=0)
+    rows[~valid.any(axis=0)] = -1
+    return rows
+
+
+def latest_meta(df, dates=None):
+    """last known Scheme Name + ISINs per scheme code"""
+    if dates is None:
+        dates = parse_dates(df['Date'])
+    return last_known(df, dates, META_FIELDS)
+
+
+class NavMatrix:
+    def __init__(self, navs, dates, scheme_codes, first_rows=None, meta=None):
+        self.navs = navs
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.scheme_codes = np.asarray(scheme_codes, dtype=np.int64)
+        self.first_rows = first_valid_rows(navs) if first_rows is None else np.asarray(first_rows, dtype=np.int64)
+        if meta is None:
+            meta = pd.DataFrame(index=pd.Index(self.scheme_codes, name='Scheme Code'), columns=META_FIELDS)
+        self.meta = meta
+        self._code_index = self._isin_index = None
+
+    @classmethod
+    def from_history(cls, df):
+        """build from the long-format history (store / consolidater frame)"""
+        dates = parse_dates(df['Date'])
+        navs, row_dates, scheme_codes = build_nav_wide(df, dates)
+        meta = latest_meta(df, dates).reindex(pd.Index(scheme_codes, name='Scheme Code'))
+        return cls(navs, row_dates, scheme_codes, meta=meta)
+
+    # -- persistence --
+    @staticmethod
+    def exists(path=NAV_MATRIX_PATH):
+        return all(os.path.exists(os.path.join(path, f)) for f in ("navs.npy", "dates.npy", "scheme_codes.npy", "first_rows.npy"))
+
+    @classmethod
+    def load(cls, path=NAV_MATRIX_PATH, mmap_mode="r"):
+        """`mmap_mode="r"` maps the NAV array instead of reading it, so row gathers only touch the rows they need"""
+        navs = np.load(os.path.join(path, "navs.npy"), mmap_mode=mmap_mode)
+        meta_path = os.path.join(path, "schemes.parquet")
+        meta = pd.read_parquet(meta_path) if os.path.exists(meta_path) else None
+        return cls(navs,
+                   np.load(os.path.join(path, "dates.npy")),
+                   np.load(os.path.join(path, "scheme_codes.npy")),
+                   np.load(os.path.join(path, "first_rows.npy")),
+                   meta)
+
+    def save(self, path=NAV_MATRIX_PATH, dtype=None):
+        """`dtype=np.float32` halves the file for analytics copies; the returns engine expects float64"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "navs.npy"), np.ascontiguousarray(self.navs, dtype=dtype))
+        self._save_index(path)
+
+    def _save_index(self, path):
+        np.save(os.path.join(path, "dates.npy"), self.dates)
+        np.save(os.path.join(path, "scheme_codes.npy"), self.scheme_codes)
+        np.save(os.path.join(path, "first_rows.npy"), self.first_rows)
+        growth, reinvest = self.isins()
+        np.save(os.path.join(path, "isins_growth.npy"), growth)
+        np.save(os.path.join(path, "isins_reinvest.npy"), reinvest)
+        self.meta.astype(object).to_parquet(os.path.join(path, "schemes.parquet"))
+
+    # -- index lookups --
+    def isins(self):
+        """(growth, reinvestment) ISIN arrays aligned with the columns"""
+        def column(field):
+            values = self.meta[field].reindex(self.scheme_codes).astype(object)
+            return np.array([v if isinstance(v, str) else "" for v in values], dtype="U12")
+        return column('ISIN Div Payout/ISIN Growth'), column('ISIN Div Reinvestment')
+
+    def columns(self, scheme_codes=None, isins=None):
+        """column positions of AMFI scheme codes and/or ISINs (either ISIN of a scheme); -1 = unknown"""
+        if self._code_index is None:
+            growth, reinvest = self.isins()
+            n = len(self.scheme_codes)
+            isin_keys = np.concatenate([growth, reinvest])
+            keep = isin_keys != ""
+            self._code_index = pd.Index(self.scheme_codes)
+            self._isin_index = pd.Series(np.tile(np.arange(n), 2)[keep], index=isin_keys[keep])
+            self._isin_index = self._isin_index[~self._isin_index.index.duplicated()]
+        positions = []
+        if scheme_codes is not None:
+            positions.append(self._code_index.get_indexer(np.asarray(scheme_codes, dtype=np.int64)))
+        if isins is not None:
+            positions.append(self._isin_index.reindex(list(isins)).fillna(-1).to_numpy(dtype=np.int64))
+        return np.concatenate(positions) if positions else np.arange(len(self.scheme_codes))
+
+    def rows(self, start=None, end=None):
+        """row slice covering the dates in [start, end]"""
+        lo = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start).date(), "D"), side="left")
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end).date(), "D"), side="right")
+        return slice(int(lo), int(hi))
+
+    def slice(self, scheme_codes=None, isins=None, start=None, end=None):
+        """dates x requested schemes NAV frame; only the requested block is read from the mapped array"""
+        columns = self.columns(scheme_codes, isins)
+        if (columns < 0).any():
+            print(f"{(columns < 0).sum()} unknown scheme codes/ISINs skipped")
+            columns = columns[columns >= 0]
+        rows = self.rows(start, end)
+        return pd.DataFrame(np.asarray(self.navs[rows][:, columns]),
+                            index=pd.DatetimeIndex(self.dates[rows], name='Date'),
+                            columns=pd.Index(self.scheme_codes[columns], name='Scheme Code'))
+
+    # -- incremental update --
+    def append(self, df, path=None):
+        """add the rows of `df` (normally one day from NAVAll) as new forward-filled rows.
+            new scheme codes become new columns. With `path` the change is written through: when no column was
+            added only the new rows are appended to navs.npy, otherwise the file is rewritten.
+            returns False when `df` holds dates older than the last row (the matrix must be rebuilt)."""
+        if len(df) == 0:
+            return True
+        dates = parse_dates(df['Date'])
+        day_wide = _daily_wide(df, dates)
+        day_dates = day_wide.index.to_numpy(dtype="datetime64[D]")
+        if len(self.dates) and day_dates[0] < self.dates[-1]:
+            print(f"NAVs for {day_dates[0]} precede the matrix end {self.dates[-1]}; rebuild required")
+            return False
+
+        # new schemes -> new columns
+        new_codes = np.setdiff1d(day_wide.columns.to_numpy(dtype=np.int64), self.scheme_codes)
+        if len(new_codes):
+            self.navs = np.hstack([np.asarray(self.navs), np.full((len(self.navs), len(new_codes)), np.nan, dtype=self.navs.dtype)])
+            self.scheme_codes = np.concatenate([self.scheme_codes, new_codes])
+            self.first_rows = np.concatenate([self.first_rows, np.full(len(new_codes), -1, dtype=np.int64)])
+            self.meta = pd.concat([self.meta, pd.DataFrame(index=pd.Index(new_codes, name='Scheme Code'), columns=META_FIELDS)])
+            self._code_index = self._isin_index = None
+
+        columns = pd.Index(self.scheme_codes).get_indexer(day_wide.columns)
+        last_row = np.asarray(self.navs[-1]) if len(self.dates) else np.full(len(self.scheme_codes), np.nan)
+        replace_last = len(self.dates) and day_dates[0] == self.dates[-1]
+        if replace_last:
+            last_row = np.asarray(self.navs[-2]) if len(self.dates) > 1 else np.full(len(self.scheme_codes), np.nan)
+
+        rows = np.empty((len(day_dates), len(self.scheme_codes)), dtype=self.navs.dtype)
+        for i, values in enumerate(day_wide.to_numpy(dtype=np.float64)):
+            row = last_row.copy()
+            known = ~np.isnan(values)
+            row[columns[known]] = values[known]
+            rows[i] = last_row = row
+
+        kept = len(self.dates) - (1 if replace_last else 0)
+        self.first_rows[self.first_rows >= kept] = -1   # first seen on the replaced row: found again below if still there
+        appeared = (self.first_rows < 0) & ~np.isnan(rows).all(axis=0)
+        self.first_rows[appeared] = kept + (~np.isnan(rows[:, appeared])).argmax(axis=0)
+
+        self.dates = np.concatenate([self.dates[:kept], day_dates])
+        meta = latest_meta(df, dates)
+        self.meta.loc[meta.index, META_FIELDS] = meta.combine_first(self.meta.loc[meta.index, META_FIELDS]).to_numpy()
+        self._code_index = self._isin_index = None
+
+        if path is not None and not len(new_codes) and self.exists(path):
+            npy_path = os.path.join(path, "navs.npy")
+            mapped = isinstance(self.navs, np.memmap) and os.path.samefile(self.navs.filename, npy_path)
+            if mapped:
+                self.navs = None   # release the mapping before navs.npy is written and truncated in place (Windows)
+            if _write_rows(npy_path, rows, kept):
+                self.navs = np.load(npy_path, mmap_mode="r")
+                self._save_index(path)
+                return True
+            if mapped:
+                self.navs = np.load(npy_path, mmap_mode="r")   # nothing was written
+        self.navs = np.vstack([np.asarray(self.navs)[:kept], rows])
+        if path is not None:
+            self.save(path)
+        return True
+
+
+def _write_rows(npy_path, rows, at_row):
+    """write `rows` into navs.npy starting at row `at_row` and patch the header's shape in place.
+        returns False when the header cannot be patched (the caller rewrites the file)."""
+    with open(npy_path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_start = f.tell()
+        if fortran_order or dtype != rows.dtype or shape[1] != rows.shape[1] or at_row > shape[0]:
+            return False
+        prefix = 10 if version == (1, 0) else 12
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                       'shape': (at_row + len(rows), shape[1])})
+        if len(header) + 1 > data_start - prefix:
+            return False
+        # rows first, header last: an interrupted write leaves the old shape valid
+        f.seek(data_start + at_row * shape[1] * dtype.itemsize)
+        f.write(np.ascontiguousarray(rows).tobytes())
+        f.truncate()
+        f.seek(prefix)
+        f.write((header.ljust(data_start - prefix - 1) + "\n").encode("latin1"))
+    return True
+
+
+def load_or_build(df_loader, path=NAV_MATRIX_PATH):
+    """persisted matrix when present, otherwise built from `df_loader()` and saved"""
+    if NavMatrix.exists(path):
+        return NavMatrix.load(path)
+    nav_matrix = NavMatrix.from_history(df_loader())
+    nav_matrix.save(path)
+    return NavMatrix.load(path)
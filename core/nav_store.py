@@ -0,0 +1,218 @@
+#%%
+import itertools
+import os
+import re
+import shutil
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Columnar NAV store: a hive-partitioned (year=YYYY) parquet dataset with typed columns.
+# `nav_time_series.csv` is only produced on demand through `export_nav_csv`.
+#
+# Files are named after the tag of the writer that added them: `consolidated` (historical_nav/*.txt, see
+# `consolidater`), `nav-<date>` (the day's NAVAll) and `history-<timestamp>` (direct nav-history downloads).
+# The store is the only copy of the appended rows, so a writer only ever replaces its own tag
+# (`replace_nav_store_tag`); `write_nav_store` rebuilds the whole store and is for compaction and migrations only.
+
+NAV_STORE_PATH = "nav_store"
+
+NAV_COLUMNS = ["Scheme Code", "Scheme Name", "ISIN Div Payout/ISIN Growth",
+               "ISIN Div Reinvestment", "Net Asset Value", "Date"]
+# NAVAll section headers, kept when the rows come from the daily file (null for consolidated history)
+SECTION_COLUMNS = ["AMC", "Scheme Category"]
+# when the row was written to the store: a (code, date) pair stored more than once keeps its latest copy.
+# files written before the column existed read as null (older than any stamped row)
+INGESTED_COLUMN = "Ingested At"
+
+_dictionary = pa.dictionary(pa.int32(), pa.string())
+NAV_SCHEMA = pa.schema([
+    ("Scheme Code", pa.int64()),
+    ("Scheme Name", _dictionary),
+    ("ISIN Div Payout/ISIN Growth", _dictionary),
+    ("ISIN Div Reinvestment", _dictionary),
+    ("Net Asset Value", pa.float64()),
+    ("Date", pa.date32()),
+    ("AMC", _dictionary),
+    ("Scheme Category", _dictionary),
+    (INGESTED_COLUMN, pa.timestamp("us")),
+    ("year", pa.int16()),
+])
+_PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16())]), flavor="hive")
+
+
+def _to_table(df):
+    """Normalise a long-format NAV frame (as produced by the text/CSV readers) into a typed arrow table.
+        rows without an ingest time (all of them, unless the frame was read back from the store) are stamped now."""
+    df = df.reindex(columns=NAV_COLUMNS + SECTION_COLUMNS + [INGESTED_COLUMN])
+    codes = pd.to_numeric(df["Scheme Code"], errors="coerce")
+    dates = pd.to_datetime(df["Date"], errors="coerce")
+    keep = (codes.notna() & dates.notna()).to_numpy()
+    df, codes, dates = df[keep], codes[keep], dates[keep]
+
+    def strings(col):
+        values = df[col].astype("string")
+        return pa.array(values.astype(object).where(values.notna(), None), type=pa.string()).dictionary_encode()
+
+    return pa.table({
+        "Scheme Code": pa.array(codes.to_numpy(dtype=np.int64)),
+        "Scheme Name": strings("Scheme Name"),
+        "ISIN Div Payout/ISIN Growth": strings("ISIN Div Payout/ISIN Growth"),
+        "ISIN Div Reinvestment": strings("ISIN Div Reinvestment"),
+        "Net Asset Value": pa.array(pd.to_numeric(df["Net Asset Value"], errors="coerce").to_numpy(dtype=np.float64)),
+        "Date": pa.array(dates.to_numpy(dtype="datetime64[D]"), type=pa.date32()),
+        "AMC": strings("AMC"),
+        "Scheme Category": strings("Scheme Category"),
+        INGESTED_COLUMN: pa.array(pd.to_datetime(df[INGESTED_COLUMN]).fillna(pd.Timestamp.now())
+                                  .to_numpy(dtype="datetime64[us]"), type=pa.timestamp("us")),
+        "year": pa.array(dates.dt.year.to_numpy(dtype=np.int16)),
+    }, schema=NAV_SCHEMA)
+
+
+def _write(table, store_path, tag, existing_data_behavior):
+    """-> paths of the files written"""
+    written = []
+    ds.write_dataset(table, store_path, format="parquet",
+                     partitioning=_PARTITIONING,
+                     basename_template=f"{tag}-{{i}}.parquet",
+                     existing_data_behavior=existing_data_behavior,
+                     file_visitor=lambda file: written.append(os.path.normpath(file.path)))
+    return written
+
+
+def write_nav_store(df, store_path=NAV_STORE_PATH):
+    """Replace the whole store with the rows of `df`, dropping every tag's rows (appended daily / downloaded
+        ones included): only for rows read back from the store itself (`compact_nav_store`) or a migration."""
+    table = _to_table(df)
+    tmp_path = store_path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    _write(table, tmp_path, "nav", "overwrite_or_ignore")
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.replace(tmp_path, store_path)
+    print(f"NAV store written to {store_path} ({table.num_rows} rows)")
+    return table.num_rows
+
+
+def append_nav_store(df, store_path=NAV_STORE_PATH, tag=None):
+    """Add the rows of `df` to the store.
+        files are named after `tag` (default: latest date in `df`), so re-appending the same tag replaces it."""
+    table = _to_table(df)
+    if table.num_rows == 0:
+        return 0
+    if tag is None:
+        tag = f"nav-{pd.Timestamp(max(table.column('Date').to_pylist())).date()}"
+    _write(table, store_path, tag, "overwrite_or_ignore")
+    return table.num_rows
+
+
+def replace_nav_store_tag(df, store_path=NAV_STORE_PATH, tag="consolidated"):
+    """Replace the rows stored under `tag` with the rows of `df`, leaving every other tag's files untouched.
+        the new files are written before the tag's old ones are removed, so a crash in between only leaves
+        duplicates (resolved by ingest time), never a gap."""
+    pattern = re.compile(rf"{re.escape(tag)}-\d+\.parquet")
+    old = {os.path.normpath(path) for path in _files(store_path) if pattern.fullmatch(os.path.basename(path))}
+    table = _to_table(df)
+    written = _write(table, store_path, tag, "overwrite_or_ignore") if table.num_rows else []
+    for path in old.difference(written):
+        os.remove(path)
+    print(f"NAV store tag {tag!r} replaced in {store_path} ({table.num_rows} rows, {len(old)} old files)")
+    return table.num_rows
+
+
+def compact_nav_store(store_path=NAV_STORE_PATH):
+    """Rewrite the store with one row per (Scheme Code, Date), the most recently ingested one winning
+        (files are read in name order, which says nothing about when they were written)."""
+    df = read_nav_store(store_path, columns=NAV_COLUMNS + SECTION_COLUMNS + [INGESTED_COLUMN])
+    df = df.sort_values(INGESTED_COLUMN, kind="stable", na_position="first")
+    return write_nav_store(df.drop_duplicates(["Scheme Code", "Date"], keep="last"), store_path)
+
+
+def nav_store_exists(store_path=NAV_STORE_PATH):
+    return os.path.isdir(store_path) and any(True for _ in _files(store_path))
+
+
+def _files(store_path):
+    for root, _, files in os.walk(store_path):
+        for file in files:
+            if file.endswith(".parquet"):
+                yield os.path.join(root, file)
+
+
+def _dataset(store_path):
+    return ds.dataset(store_path, format="parquet", partitioning=_PARTITIONING, schema=NAV_SCHEMA)
+
+
+def _filter(start=None, end=None, scheme_codes=None):
+    filters = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [ds.field("year") >= start.year, ds.field("Date") >= pa.scalar(start.date(), pa.date32())]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [ds.field("year") <= end.year, ds.field("Date") <= pa.scalar(end.date(), pa.date32())]
+    if scheme_codes is not None:
+        filters.append(ds.field("Scheme Code").isin(pa.array(list(map(int, scheme_codes)), pa.int64())))
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+    return expr
+
+
+def read_nav_store(store_path=NAV_STORE_PATH, columns=None, start=None, end=None, scheme_codes=None):
+    """Read the store into the long-format frame used across `core`.
+        `start`/`end`/`scheme_codes` are pushed down so only the matching partitions/row groups are decoded."""
+    if not nav_store_exists(store_path):
+        return pd.DataFrame(columns=columns or NAV_COLUMNS)
+
+    table = _dataset(store_path).to_table(columns=columns or NAV_COLUMNS, filter=_filter(start, end, scheme_codes))
+    df = table.to_pandas(date_as_object=False)
+    if "Date" in df.columns:
+        df["Date"] = df["Date"].astype("datetime64[ns]")
+    return df
+
+
+def scan_nav_store(store_path=NAV_STORE_PATH, columns=None, batch_rows=500_000, start=None, end=None, scheme_codes=None):
+    """`read_nav_store` as a stream of frames of about `batch_rows` rows, so the whole store is never in memory.
+        the scanner's row-group sized record batches are coalesced up to `batch_rows` before conversion"""
+    if not nav_store_exists(store_path):
+        return
+    scanner = _dataset(store_path).scanner(columns=columns or NAV_COLUMNS, filter=_filter(start, end, scheme_codes),
+                                           batch_size=batch_rows)
+    pending, rows = [], 0
+    for batch in itertools.chain(scanner.to_batches(), [None]):
+        if batch is not None:
+            pending.append(batch)
+            rows += batch.num_rows
+            if rows < batch_rows:
+                continue
+        if rows:
+            df = pa.Table.from_batches(pending, scanner.projected_schema).to_pandas(date_as_object=False)
+            if "Date" in df.columns:
+                df["Date"] = df["Date"].astype("datetime64[ns]")
+            yield df
+        pending, rows = [], 0
+
+
+def export_nav_csv(store_path=NAV_STORE_PATH, csv_path="nav_time_series.csv"):
+    """Export the store in the legacy `nav_time_series.csv` layout (semicolon separated)."""
+    df = read_nav_store(store_path).sort_values(["Date", "Scheme Code"], kind="stable")
+    df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+    df.to_csv(csv_path, index=False, sep=";")
+    return csv_path
+
+
+def import_nav_csv(csv_path="nav_time_series.csv", store_path=NAV_STORE_PATH):
+    """One-off migration of an existing `nav_time_series.csv` into the store."""
+    df = pd.read_csv(csv_path, delimiter=";", dtype=str).dropna(subset=["Scheme Code"])
+    return write_nav_store(df, store_path)
+
+
+#%%
+if __name__ == "__main__":
+    if not nav_store_exists() and os.path.exists("nav_time_series.csv"):
+        import_nav_csv()
+    print(f"exported {export_nav_csv()}")
@@ -0,0 +1,113 @@
+#%%
+import gzip
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from datetime import datetime
+
+# Vectorised parser for AMFI's NAVAll.txt (arrow string kernels over all lines at once):
+#   Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date
+#   Open Ended Schemes(Debt Scheme - Banking and PSU Fund)      <- scheme category section
+#   Aditya Birla Sun Life Mutual Fund                           <- AMC section
+#   119551;INF209KA12Z1;INF209KA13Z9;Aditya Birla Sun Life ...;105.4781;17-Oct-2025
+
+NAVALL_FIELDS = ["scheme_code", "isin_growth", "isin_reinvest", "scheme_name", "nav", "date", "amc", "category"]
+
+NAVALL_COLUMNS = {
+    "scheme_code": "Scheme Code",
+    "scheme_name": "Scheme Name",
+    "isin_growth": "ISIN Div Payout/ISIN Growth",
+    "isin_reinvest": "ISIN Div Reinvestment",
+    "nav": "Net Asset Value",
+    "date": "Date",
+    "amc": "AMC",
+    "category": "Scheme Category",
+}
+_NUMBER = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+
+def _isin(values):
+    return pc.if_else(pc.equal(values, "-"), "", values)
+
+
+def _section(rows, positions, texts):
+    """text of the last header at `positions` on or before each of `rows` ("" before the first one)"""
+    marker = np.full(rows[-1] + 1 if len(rows) else 0, -1)
+    marker[positions[positions < len(marker)]] = np.flatnonzero(positions < len(marker))
+    return np.array(list(texts) + [""], dtype=object)[np.maximum.accumulate(marker)[rows]]
+
+
+def _dates(values):
+    """dates written like 17-Oct-2025 -> datetime64[D]; each distinct value is parsed once (NaT when unparseable)"""
+    encoded = pc.dictionary_encode(values).combine_chunks() if isinstance(values, pa.ChunkedArray) else pc.dictionary_encode(values)
+    parsed = []
+    for raw in encoded.dictionary.to_pylist():
+        try:
+            parsed.append(np.datetime64(datetime.strptime(raw, "%d-%b-%Y").date(), "D"))
+        except ValueError:
+            parsed.append(np.datetime64("NaT", "D"))
+    return np.array(parsed, dtype="datetime64[D]")[encoded.indices.to_numpy(zero_copy_only=False)]
+
+
+def parse_navall_text(text):
+    """
+    NAVAll content -> columnar arrays (dict of numpy arrays keyed by `NAVALL_FIELDS`), one entry per scheme line,
+    tagged with the AMC and scheme category of the section it sits in.
+    the lines are split once and every step is an arrow kernel over all of them; section headers (lines with fewer
+    than 6 fields) are forward filled onto the scheme lines by row position
+    """
+    lines = pc.utf8_trim_whitespace(pa.array(text.splitlines(), pa.string()))
+    lines = lines.filter(pc.not_equal(lines, ""))
+    fields = pc.split_pattern(lines, ";")
+    header = pc.less(pc.list_value_length(fields), 6).to_numpy(zero_copy_only=False)
+    rows = np.flatnonzero(~header)
+    fields = fields.take(rows)
+    field = lambda i: pc.utf8_trim_whitespace(pc.list_element(fields, i))
+    code = field(0)
+    scheme = pc.utf8_is_digit(code).to_numpy(zero_copy_only=False)    # drops the column header
+    rows, fields, code = rows[scheme], fields.filter(scheme), code.filter(scheme)
+
+    # section headers (a few hundred lines): "... Schemes(<category>)" or the AMC name
+    headers = np.flatnonzero(header)
+    texts = lines.take(headers).to_pylist()
+    is_category = np.array([text.endswith(")") and "Schemes(" in text for text in texts], dtype=bool)
+    nav = field(4)
+    nav = pc.if_else(pc.match_substring_regex(nav, _NUMBER), nav, pa.scalar(None, pa.string()))   # "N.A." -> NaN
+    return {
+        "scheme_code": pc.cast(code, pa.int64()).to_numpy(),
+        "isin_growth": _isin(field(1)).to_numpy(zero_copy_only=False),
+        "isin_reinvest": _isin(field(2)).to_numpy(zero_copy_only=False),
+        "scheme_name": field(3).to_numpy(zero_copy_only=False),
+        "nav": pc.cast(nav, pa.float64()).to_numpy(zero_copy_only=False),
+        "date": _dates(field(5)),
+        "amc": _section(rows, headers[~is_category], [t for t, c in zip(texts, is_category) if not c]),
+        "category": _section(rows, headers[is_category], [t for t, c in zip(texts, is_category) if c]),
+    }
+
+
+def open_navall(file_path):
+    """text handle on a NAVAll file, plain or gzip-archived (`.gz`)"""
+    if str(file_path).endswith(".gz"):
+        return gzip.open(file_path, "rt", encoding="utf-8", errors="replace")
+    return open(file_path, "r", encoding="utf-8", errors="replace")
+
+
+def parse_navall(file_path):
+    """NAVAll file (plain or `.gz`) -> columnar arrays (dict of numpy arrays keyed by `NAVALL_FIELDS`)"""
+    with open_navall(file_path) as f:
+        return parse_navall_text(f.read())
+
+
+def read_navall(file_path):
+    """NAVAll file -> long-format frame with the NAV store column names plus `AMC` and `Scheme Category`"""
+    arrays = parse_navall(file_path)
+    return pd.DataFrame({NAVALL_COLUMNS[field]: arrays[field] for field in NAVALL_FIELDS})
+
+
+#%%
+if __name__ == "__main__":
+    import sys
+    df = read_navall(sys.argv[1] if len(sys.argv) > 1 else "daily_nav/NAVAll.txt")
+    print(df.groupby(["AMC"]).size().sort_values().tail(10))
+    print(df.head())
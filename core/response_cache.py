@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# off: network only | record: network, every 200 is stored | replay: cache only, a miss raises `CacheMiss`
+HTTP_CACHE = os.environ.get("HTTP_CACHE", "off").lower()
+HTTP_CACHE_PATH = os.environ.get("HTTP_CACHE_PATH", ".http_cache")
+CACHE_MODES = ("off", "record", "replay")
+# validators worth replaying; the body is stored decoded so transfer headers are dropped
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Date")
+
+
+class CacheMiss(requests.exceptions.RequestException):
+    """replay mode and the url was never recorded"""
+
+
+def normalize_url(url):
+    """scheme/host lower-cased, query parameters sorted, fragment dropped"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+class ResponseCache:
+    """on-disk cache of GET responses. bodies are content-addressed and gzip-compressed
+        (`bodies/<sha256 of body>.gz`, so identical payloads are stored once); `urls/<sha256 of normalized url>.json`
+        holds the fetch metadata (url, status, kept headers, fetched_at, elapsed) and points at the body"""
+    def __init__(self, path=HTTP_CACHE_PATH, mode=HTTP_CACHE):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"HTTP cache mode must be one of {CACHE_MODES}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        if mode != "off":
+            os.makedirs(os.path.join(path, "urls"), exist_ok=True)
+            os.makedirs(os.path.join(path, "bodies"), exist_ok=True)
+
+    def _meta_path(self, url):
+        key = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.path, "urls", f"{key}.json")
+
+    @staticmethod
+    def _write(path, data, opener=open):
+        """write `data` to a temp file of its own next to `path` and move it in place, so threads storing the
+            same body or url never share (or truncate) each other's temp file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            with opener(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def store(self, url, response, elapsed):
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = os.path.join(self.path, "bodies", f"{digest}.gz")
+        if not os.path.exists(body_path):
+            self._write(body_path, body, gzip.open)
+        meta = {"url": normalize_url(url), "status": response.status_code, "body": digest, "bytes": len(body),
+                "headers": {k: response.headers[k] for k in KEPT_HEADERS if k in response.headers},
+                "fetched_at": time.time(), "elapsed": elapsed}
+        self._write(self._meta_path(url), json.dumps(meta).encode())
+
+    def replay(self, url):
+        """the recorded response for `url` as a `requests.Response`"""
+        meta_path = self._meta_path(url)
+        if not os.path.exists(meta_path):
+            raise CacheMiss(f"not in the HTTP cache ({self.path}): {url}")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        with gzip.open(os.path.join(self.path, "bodies", f"{meta['body']}.gz"), "rb") as f:
+            body = f.read()
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = url
+        response.reason = "replayed"
+        response._content = body
+        response._content_consumed = True   # so streamed reads (`iter_content`) serve the recorded body
+        return response
@@ -0,0 +1,131 @@
+#%%
+import os
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from core.calculator import asof_rows, take_rows, formula_simple, formula_cagr
+from core.nav_matrix import NAV_MATRIX_PATH, NavMatrix
+
+# Rolling 1y / 3y / 5y returns of every scheme over the forward-filled NAV matrix.
+# The window's base row of every date is resolved once per window with one searchsorted (the same as-of rule
+# as `calculate_returns`: last NAV on or before date - window); the rolling series of a block of schemes is then
+# one gather of those rows and an element-wise division, and the summary statistics are column-wise reductions.
+# Series end on business days only, so weekend rows (Friday's NAV carried forward) don't weight the distribution.
+
+ROLLING_WINDOWS = [("1Y", 365), ("3Y", 3 * 365), ("5Y", 5 * 365)]
+# CAGR levels (%) for the share of rolling periods beating them: pct_above_<level>
+ROLLING_THRESHOLDS = [0, 8, 12]
+ROLLING_BLOCK = int(os.environ.get("ROLLING_BLOCK", 1024))   # schemes per block (memory ~ dates x block x 24 bytes)
+ROLLING_SUMMARY_PATH = "rolling_returns_summary.csv"
+SUMMARY_COLUMNS = ['observations', 'return_min', 'return_median', 'return_max',
+                   'cagr_min', 'cagr_median', 'cagr_mean', 'cagr_max']
+
+
+def window_days(window):
+    """days of a `ROLLING_WINDOWS` name ("3Y") or of a number of days"""
+    return dict(ROLLING_WINDOWS)[window] if isinstance(window, str) else int(window)
+
+
+def base_rows(dates, days):
+    """row of the last date <= each row's date - `days` (-1 when that precedes the history)"""
+    return asof_rows(dates, dates - np.timedelta64(days, "D"))
+
+
+def end_rows(dates, start=None, end=None):
+    """business-day rows within [start, end] at which rolling periods end"""
+    rows = np.flatnonzero(np.is_busday(dates))
+    if start is not None:
+        rows = rows[dates[rows] >= np.datetime64(pd.Timestamp(start).date(), "D")]
+    if end is not None:
+        rows = rows[dates[rows] <= np.datetime64(pd.Timestamp(end).date(), "D")]
+    return rows
+
+
+def rolling_block(navs, bases, rows, days):
+    """([rows x schemes] rolling return %, rolling CAGR %) of a [dates x schemes] NAV block, periods ending at `rows`"""
+    latest = navs[rows]
+    past = take_rows(navs, bases[rows])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return formula_simple(latest, past), formula_cagr(latest, past, days / 365)
+
+
+def rolling_returns(nav_matrix, window="3Y", scheme_codes=None, isins=None, start=None, end=None, cagr=True):
+    """
+    dates x schemes frame of the rolling `window` CAGR (or simple return with `cagr=False`), in %,
+    of the requested schemes (all when neither `scheme_codes` nor `isins` is given) for periods ending in [start, end]
+    """
+    columns = nav_matrix.columns(scheme_codes, isins)
+    if (columns < 0).any():
+        print(f"{(columns < 0).sum()} unknown scheme codes/ISINs skipped")
+        columns = columns[columns >= 0]
+    days = window_days(window)
+    rows = end_rows(nav_matrix.dates, start, end)
+    navs = np.asarray(nav_matrix.navs[:, columns], dtype=np.float64)
+    simple, annualised = rolling_block(navs, base_rows(nav_matrix.dates, days), rows, days)
+    return pd.DataFrame(annualised if cagr else simple,
+                        index=pd.DatetimeIndex(nav_matrix.dates[rows], name='Date'),
+                        columns=pd.Index(nav_matrix.scheme_codes[columns], name='Scheme Code'))
+
+
+def summarise(simple, annualised, thresholds=ROLLING_THRESHOLDS):
+    """column-wise distribution of a [periods x schemes] rolling series -> {column: [schemes]}"""
+    valid = ~np.isnan(annualised)
+    observations = valid.sum(axis=0)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)   # schemes without a full period yet (all-NaN columns)
+        stats = {
+            'observations': observations,
+            'return_min': np.nanmin(simple, axis=0),
+            'return_median': np.nanmedian(simple, axis=0),
+            'return_max': np.nanmax(simple, axis=0),
+            'cagr_min': np.nanmin(annualised, axis=0),
+            'cagr_median': np.nanmedian(annualised, axis=0),
+            'cagr_mean': np.nanmean(annualised, axis=0),
+            'cagr_max': np.nanmax(annualised, axis=0),
+        }
+        for level in thresholds:
+            stats[f"pct_above_{level:g}"] = (annualised > level).sum(axis=0) / observations * 100
+    return stats
+
+
+def rolling_summary(nav_matrix, windows=ROLLING_WINDOWS, thresholds=ROLLING_THRESHOLDS, start=None, end=None,
+                    block=ROLLING_BLOCK):
+    """
+    distribution of every scheme's rolling returns per window, for periods ending in [start, end] -> long frame
+    (Scheme Code, ISIN, window, `SUMMARY_COLUMNS`, pct_above_<level> for each of `thresholds`).
+    returns / CAGRs are in %; a scheme is reported for a window once it has one full period
+    """
+    dates = nav_matrix.dates
+    rows = end_rows(dates, start, end)
+    bases = {window: base_rows(dates, days) for window, days in windows}
+    growth, _ = nav_matrix.isins()
+    columns = ['Scheme Code', 'ISIN', 'window'] + SUMMARY_COLUMNS + [f"pct_above_{level:g}" for level in thresholds]
+
+    frames = []
+    for lo in range(0, len(nav_matrix.scheme_codes), block):
+        schemes = slice(lo, lo + block)
+        navs = np.asarray(nav_matrix.navs[:, schemes], dtype=np.float64)
+        for window, days in windows:
+            periods = rows[bases[window][rows] >= 0]
+            if len(periods) == 0:
+                continue
+            stats = summarise(*rolling_block(navs, bases[window], periods, days), thresholds)
+            reported = np.flatnonzero(stats['observations'] > 0)
+            frame = pd.DataFrame({column: values[reported] for column, values in stats.items()})
+            frame.insert(0, 'Scheme Code', nav_matrix.scheme_codes[schemes][reported])
+            frame.insert(1, 'ISIN', growth[schemes][reported])
+            frame.insert(2, 'window', window)
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+#%%
+if __name__ == "__main__":
+    started = time.perf_counter()
+    summary = rolling_summary(NavMatrix.load(NAV_MATRIX_PATH))
+    summary.to_csv(ROLLING_SUMMARY_PATH, index=False, sep=";")
+    print(f"{len(summary)} scheme-windows written to {ROLLING_SUMMARY_PATH} in {time.perf_counter() - started:.2f}s")
+    print(summary.groupby('window')[SUMMARY_COLUMNS[1:]].median().T)
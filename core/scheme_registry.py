@@ -0,0 +1,151 @@
+#%%
+import os
+import numpy as np
+import pandas as pd
+
+# Scheme master: one row per AMFI scheme code with its name, both ISINs, BSE code and NAVAll AMC / category,
+# persisted as scheme_registry.parquet. Lookups by AMFI code, either ISIN or BSE code go through hash indexes
+# (pd.Index / dict), so resolving a query costs O(query) instead of a scan of the sheet or the history.
+
+SCHEME_REGISTRY_PATH = "scheme_registry.parquet"
+ISIN_COLUMNS = ['ISIN Div Payout/ISIN Growth', 'ISIN Div Reinvestment']
+REGISTRY_COLUMNS = ['Scheme Name', *ISIN_COLUMNS, 'BSE Code', 'AMC', 'Scheme Category']
+ISIN_PATTERN = r"[A-Z]{3}[0-9A-Z]{9}"
+
+
+def split_isins(values):
+    """"INF209K01AB1INF209K01AC9"-style cells -> (growth/payout ISIN, reinvestment ISIN) columns, None when absent"""
+    values = pd.Series(values, dtype=object)
+    matches = values.where(values.map(lambda v: isinstance(v, str)), "").str.extractall(f"({ISIN_PATTERN})")[0]
+    isins = matches.unstack().reindex(index=values.index, columns=[0, 1])
+    isins = isins.astype(object).where(isins.notna(), None)
+    return isins[0].rename(ISIN_COLUMNS[0]), isins[1].rename(ISIN_COLUMNS[1])
+
+
+def bse_codes(values):
+    """BSE code cells -> stripped strings, None for blank / missing ones (the sheet is often read as str: "nan")"""
+    codes = pd.Series(values, dtype=object).map(lambda v: str(v).strip() if pd.notna(v) else "")
+    return codes.where(~codes.isin(["", "nan", "None"]), None).to_numpy(dtype=object)
+
+
+def last_known(df, dates, fields):
+    """latest non-null value of each of `fields` per Scheme Code, ordered by `dates` (the later row wins a tie).
+        one hash group-by per field on a packed (day, row) key instead of sorting the whole history"""
+    codes = df['Scheme Code'].to_numpy(dtype=np.int64)
+    days = np.asarray(dates, dtype="datetime64[D]")
+    key = (days.astype(np.int64) << 32) | np.arange(len(days), dtype=np.int64)
+    valid = ~np.isnat(days)
+    index = pd.Index(np.unique(codes), name='Scheme Code')
+    out = pd.DataFrame(index=index)
+    for field in fields:
+        values = df[field]
+        known = valid & values.notna().to_numpy()
+        latest = pd.Series(key[known]).groupby(codes[known]).max()
+        rows = (latest.to_numpy() & 0xFFFFFFFF).astype(np.int64)
+        out[field] = pd.Series(values.to_numpy(dtype=object)[rows], index=latest.index).reindex(index)
+    return out
+
+
+class SchemeRegistry:
+    def __init__(self, schemes=None):
+        if schemes is None:
+            schemes = pd.DataFrame(index=pd.Index([], dtype=np.int64, name='Scheme Code'), columns=REGISTRY_COLUMNS)
+        # blank cells are unknown, like missing ones, so they never win a merge
+        self.schemes = schemes.reindex(columns=REGISTRY_COLUMNS).astype(object).replace("", None)
+        self.schemes.index = pd.Index(self.schemes.index.astype(np.int64), name='Scheme Code')
+        self._isin_index = self._bse_index = None
+
+    # -- loading --
+    @classmethod
+    def from_bse_sheet(cls, sheet, code_col="Code", name_col="Scheme NAV Name",
+                       isin_col="ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment", bse_col=None):
+        """BSE scheme data sheet (frame) -> registry; the combined ISIN cell is split with one vectorised regex pass.
+            BSE codes come from `bse_col` when the sheet has that column (blank cells are left unknown)"""
+        codes = pd.to_numeric(sheet[code_col], errors="coerce")
+        keep = codes.notna().to_numpy()
+        sheet = sheet[keep]
+        growth, reinvest = split_isins(sheet[isin_col])
+        schemes = pd.DataFrame({
+            'Scheme Name': sheet[name_col].to_numpy(dtype=object),
+            ISIN_COLUMNS[0]: growth.to_numpy(),
+            ISIN_COLUMNS[1]: reinvest.to_numpy(),
+            'BSE Code': bse_codes(sheet[bse_col]) if bse_col is not None and bse_col in sheet else None,
+        }, index=pd.Index(codes[keep].astype(np.int64).to_numpy(), name='Scheme Code'))
+        return cls(schemes[~schemes.index.duplicated(keep="last")])
+
+    @classmethod
+    def from_navall(cls, df):
+        """rows of `navall_parser.read_navall` (or the day's NAV frame) -> registry with AMC / category"""
+        if len(df) == 0:
+            return cls()
+        schemes = df.drop_duplicates('Scheme Code', keep="last").set_index('Scheme Code')
+        schemes = schemes.reindex(columns=REGISTRY_COLUMNS).replace("", None)
+        return cls(schemes)
+
+    @classmethod
+    def from_history(cls, df, dates=None):
+        """latest known name / ISINs per scheme of a long-format history (blank values count as unknown)"""
+        if dates is None:
+            from core.nav_matrix import parse_dates
+            dates = parse_dates(df['Date'])
+        fields = [field for field in REGISTRY_COLUMNS if field in df.columns]
+        known = df[['Scheme Code', *fields]].astype({field: object for field in fields}).replace("", None)
+        return cls(last_known(known, dates, fields))
+
+    @classmethod
+    def load(cls, path=SCHEME_REGISTRY_PATH):
+        return cls(pd.read_parquet(path)) if os.path.exists(path) else cls()
+
+    def save(self, path=SCHEME_REGISTRY_PATH):
+        self.schemes.to_parquet(path)
+        return path
+
+    def update(self, other):
+        """merge `other` in: its non-null fields win, a known field is never replaced by a missing / blank one,
+            schemes only known here are kept"""
+        self.schemes = other.schemes.combine_first(self.schemes).reindex(columns=REGISTRY_COLUMNS).astype(object)
+        self.schemes.index.name = 'Scheme Code'
+        self._isin_index = self._bse_index = None
+        return self
+
+    # -- lookups --
+    def __len__(self):
+        return len(self.schemes)
+
+    def __contains__(self, scheme_code):
+        return int(scheme_code) in self.schemes.index
+
+    def _isins(self):
+        if self._isin_index is None:
+            # reinvestment first so a growth ISIN wins when the same ISIN appears in both columns
+            pairs = [(isin, code) for column in reversed(ISIN_COLUMNS)
+                     for code, isin in self.schemes[column].dropna().items() if isin]
+            self._isin_index = dict(pairs)
+        return self._isin_index
+
+    def _bse_codes(self):
+        if self._bse_index is None:
+            self._bse_index = {bse: code for code, bse in self.schemes['BSE Code'].dropna().items()}
+        return self._bse_index
+
+    def codes(self, amfi_codes=(), isins=(), bse_codes=()):
+        """sorted unique AMFI scheme codes matching any of the given AMFI codes, ISINs or BSE codes"""
+        found = set()
+        amfi_codes = pd.to_numeric(pd.Series(list(amfi_codes), dtype=object), errors="coerce").dropna().astype(np.int64)
+        positions = self.schemes.index.get_indexer(amfi_codes)
+        found.update(self.schemes.index[positions[positions >= 0]])
+        isin_index, bse_index = self._isins(), self._bse_codes()
+        found.update(isin_index[isin] for isin in isins if isin in isin_index)
+        found.update(bse_index[str(bse)] for bse in bse_codes if str(bse) in bse_index)
+        return np.array(sorted(found), dtype=np.int64)
+
+    def meta(self, scheme_codes, fields=('Scheme Name', *ISIN_COLUMNS)):
+        """`fields` of `scheme_codes` (NaN for unknown schemes), indexed by Scheme Code"""
+        return self.schemes.reindex(pd.Index(np.asarray(scheme_codes, dtype=np.int64), name='Scheme Code'))[list(fields)]
+
+
+#%%
+if __name__ == "__main__":
+    registry = SchemeRegistry.load()
+    print(f"{len(registry)} schemes in {SCHEME_REGISTRY_PATH}")
+    print(registry.schemes.head())
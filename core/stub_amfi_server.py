@@ -0,0 +1,201 @@
+#%%
+# Local stand-in for the amfiindia.com endpoints used by the downloaders, for offline runs / benchmarks
+#   python -m core.stub_amfi_server --port 8765 --latency 0.1
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+@lru_cache(maxsize=64)
+def _business_days(from_date, to_date):
+    dates = pd.bdate_range(from_date, to_date)
+    return dates.strftime("%Y-%m-%d").tolist(), (dates - pd.Timestamp("2000-01-01")).days.to_numpy()
+
+
+def nav_history_records(amfi_code, from_date, to_date):
+    """deterministic business-day NAV records for one scheme, shaped like `/api/nav-history` records"""
+    dates, days = _business_days(from_date, to_date)
+    # the walk is a function of the absolute day number so overlapping windows agree on their shared dates
+    drift = np.random.default_rng(zlib.crc32(str(amfi_code).encode())).normal(0.0003, 0.0002)
+    navs = np.round(10 * np.exp(drift * days + 0.01 * np.sin(days / 7.0)), 4).tolist()
+    return [{"date": d, "nav": n, "repurchase": None} for d, n in zip(dates, navs)]
+
+
+def navall_text(date, n_amcs=20, schemes_per_amc=50):
+    """a NAVAll.txt for `date` in AMFI's layout (category / AMC section headers, `-` for missing ISINs)"""
+    lines = ["Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date", "",
+             "Open Ended Schemes(Equity Scheme - Large Cap Fund)", ""]
+    day = pd.Timestamp(date)
+    for amc in range(n_amcs):
+        lines += [f"AMC {amc} Mutual Fund", ""]
+        for i in range(schemes_per_amc):
+            code = 100000 + amc * schemes_per_amc + i
+            nav = nav_history_records(code, day, day)
+            nav = f"{nav[0]['nav']:.4f}" if nav else "N.A."
+            reinvest = f"INF{code:06d}R01" if i % 3 == 0 else "-"
+            lines.append(f"{code};INF{code:06d}G01;{reinvest};AMC {amc} Scheme {i} - Growth;{nav};{day.strftime('%d-%b-%Y')}")
+        lines.append("")
+    return "\n".join(lines).encode()
+
+
+# years of history each stub AMC has, by mf code; a report window starting earlier finds no data
+AMC_HISTORY_YEARS = (12, 7, 4, 2, 0.5)
+
+
+def amc_report_text(mf_code, from_date, to_date, schemes_per_amc=5):
+    """AMFI's `DownloadNAVHistoryReport_Po.aspx` plain-text report for one AMC (entities escaped, as AMFI sends them)"""
+    mf_code = int(mf_code)
+    from_date, to_date = pd.Timestamp(from_date), pd.Timestamp(to_date)
+    if from_date < to_date - pd.Timedelta(days=int(365.25 * AMC_HISTORY_YEARS[mf_code % len(AMC_HISTORY_YEARS)])):
+        return b"<br/>No data found on the basis of selected parameters for this report"
+    lines = ["Scheme Code;Scheme Name;ISIN Div Payout/ISIN Growth;ISIN Div Reinvestment;Net Asset Value;Repurchase Price;Sale Price;Date",
+             "", "Open Ended Schemes ( Equity Scheme - Large Cap Fund )", "", f"AMC {mf_code} Mutual Fund", ""]
+    for i in range(schemes_per_amc):
+        code = 200000 + mf_code * schemes_per_amc + i
+        for record in nav_history_records(code, from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")):
+            date = pd.Timestamp(record["date"]).strftime("%d-%b-%Y")
+            lines.append(f"{code};AMC {mf_code} Growth &amp; Income Scheme {i};INF{code:06d}G01;;{record['nav']};;;{date}")
+    return "\r\n".join(lines).encode()
+
+
+def amc_list_page(n_amcs=10):
+    """the nav-history page's AMC drop-down"""
+    options = "".join(f'<option value="{mf}">AMC {mf} Mutual Fund</option>' for mf in range(1, n_amcs + 1))
+    return f'<html><body><select id="NavHisMFName"><option value="">Select</option>{options}</select></body></html>'.encode()
+
+
+class StubAMFIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so pooled clients reuse their connections
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        if self.path in ("/_stats", "/_reset"):
+            return self._stats(reset=self.path == "/_reset")
+        if self.path == "/_publish":
+            server.navall_date = (pd.Timestamp(server.navall_date) + pd.Timedelta(days=1)).date()
+            return self._send(200, str(server.navall_date).encode(), "text/plain")
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.request_times.append(time.monotonic())
+        try:
+            time.sleep(server.latency)
+            url = urlsplit(self.path)
+            if server.fail_rate and random.random() < server.fail_rate:
+                self._send(503, b"service unavailable", "text/plain")
+            elif url.path == "/spages/NAVAll.txt":
+                self._navall()
+            elif url.path == "/net-asset-value/nav-history":
+                self._send(200, amc_list_page(), "text/html")
+            elif url.path == "/DownloadNAVHistoryReport_Po.aspx":
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self._send(200, amc_report_text(query["mf"], query["frmdt"], query["todt"]), "text/plain")
+            elif url.path == "/api/nav-history":
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                records = nav_history_records(query.get("sd_id", ""), query.get("from_date"), query.get("to_date"))
+                body = json.dumps({"data": {"nav_groups": [{"historical_records": records}]}}).encode()
+                self._send(200, body, "application/json")
+            else:
+                self._send(404, b"not found", "text/plain")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _navall(self):
+        """NAVAll for the server's `navall_date` (moved on a day by `/_publish`), with ETag / Last-Modified validators"""
+        server = self.server
+        body = navall_text(server.navall_date)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        last_modified = formatdate(pd.Timestamp(server.navall_date).timestamp(), usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self._send(200, body, "text/plain", headers)
+
+    def _stats(self, reset=False):
+        server = self.server
+        with server.lock:
+            stats = {"requests": server.requests, "connections": server.connections, "max_in_flight": server.max_in_flight,
+                     "request_times": server.request_times}
+            if reset:
+                server.requests = server.connections = server.max_in_flight = 0
+                server.request_times = []
+        self._send(200, json.dumps(stats).encode(), "application/json")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients drop streamed responses they have seen enough of; that is not an error worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(port=0, latency=0.0, fail_rate=0.0):
+    """start the stub on a daemon thread and return the server (`.base_url`); stop it with `server.shutdown()`.
+        `fail_rate` of the requests are answered with a 503 to exercise client retries.
+        request counters are served as JSON on `/_stats` (`/_reset` returns and clears them), `/_publish` moves
+        the NAVAll date on by one day"""
+    server = StubServer(("127.0.0.1", port), StubAMFIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.navall_date = pd.Timestamp.today().date()
+    server.lock = threading.Lock()
+    server.requests = server.connections = server.in_flight = server.max_in_flight = 0
+    server.request_times = []
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.latency, args.fail_rate)
+    print(f"stub AMFI server on {server.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
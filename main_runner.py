@@ -1,6 +1,8 @@
 from core.daily_calc import task
 from SQL.setup_db import db, create_app
 from SQL.returnstosql import upsert
+from SQL.navhistorytosql import sync_nav_history
+from SQL.analyticstosql import update_analytics, update_benchmark_analytics
 import sys
 import io
 import os
@@ -37,6 +39,9 @@ def main():
     try:
         with app.app_context():  # Push application context 
             upsert(returns_directory=returns_directory)
+            sync_nav_history()  # only the NAVs mf_nav_history is missing (and recent revisions)
+            update_analytics()  # risk metrics of every scheme, 1y / 3y / 5y
+            update_benchmark_analytics()  # beta / alpha / capture ratios vs each fund's benchmark
     except Exception as e:
         print("[Error]: ❌ Task Failed\n",e.__traceback__.tb_lineno,e)
         return
@@ -0,0 +1,75 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.historical_downloader_updated import HistoricalNAVDownloader, missing_ranges
+from core.nav_store import append_nav_store
+
+INCEPTION = pd.Timestamp.today().normalize() - pd.Timedelta(days=400)
+
+
+class FakeResponse:
+    ok = True
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+
+
+class FakeClient:
+    """nav-history API of one scheme launched at `INCEPTION`; `empty` is the body sent for a range with no NAVs"""
+    def __init__(self, empty):
+        self.empty = empty
+        self.requests = []
+
+    def get(self, url):
+        query = dict(part.split("=") for part in url.split("?")[1].split("&"))
+        start, end = pd.Timestamp(query["from_date"]), pd.Timestamp(query["to_date"])
+        self.requests.append((start, end))
+        dates = pd.bdate_range(max(start, INCEPTION), end)
+        if len(dates) == 0:
+            return FakeResponse(self.empty)
+        records = [{"date": d.strftime("%Y-%m-%d"), "nav": 10 + i / 100} for i, d in enumerate(dates)]
+        return FakeResponse({"data": {"nav_groups": [{"historical_records": records}]}})
+
+    def print_stats(self, label):
+        pass
+
+
+def test_missing_ranges_stops_at_first_nav():
+    start, end = np.datetime64("2020-01-01"), np.datetime64("2020-12-31")
+    dates = pd.bdate_range("2020-06-01", "2020-12-31").to_numpy()
+    assert missing_ranges(dates, start, end)[0] == (pd.Timestamp("2020-01-01"), pd.Timestamp("2020-05-31"))
+    assert missing_ranges(dates, start, end, first_nav="2020-06-01") == []
+    assert missing_ranges(dates[:0], start, end, first_nav="2020-06-01") == [(pd.Timestamp("2020-06-01"), pd.Timestamp("2020-12-31"))]
+
+
+@pytest.mark.parametrize("empty", [{"data": {"nav_groups": [{"historical_records": []}]}},
+                                   {"data": {"nav_groups": []}}])
+@pytest.mark.parametrize("journal", [True, False])
+def test_pre_inception_range_is_fetched_once(tmp_path, empty, journal):
+    sheet = tmp_path / "schemes.csv"
+    pd.DataFrame({"Code": [100001], "Scheme NAV Name": ["Young Scheme"],
+                  "ISIN Div Payout/ ISIN GrowthISIN Div Reinvestment": ["INF000000001"]}).to_csv(sheet, index=False)
+    store = str(tmp_path / "store")
+    dates = pd.bdate_range(INCEPTION, pd.Timestamp.today().normalize())
+    append_nav_store(pd.DataFrame({"Scheme Code": 100001, "Scheme Name": "Young Scheme",
+                                   "ISIN Div Payout/ISIN Growth": "INF000000001", "Net Asset Value": 10.0,
+                                   "Date": dates}), store, tag="history-0")
+
+    def sync():
+        downloader = HistoricalNAVDownloader(str(sheet), str(tmp_path / "out"), years_back=10, workers=1,
+                                             journal=journal, registry_path=None)
+        if first_navs is not None and not journal:
+            downloader.first_navs = first_navs   # one process across runs when there is no journal
+        downloader.client = FakeClient(empty)
+        downloader.sync_from_store(store)
+        return downloader
+
+    first_navs = None
+    first = sync()
+    assert first.client.requests and all(end < INCEPTION for _, end in first.client.requests)
+    first_navs = first.first_navs
+    assert first_navs == {"100001": INCEPTION}
+    assert sync().client.requests == []